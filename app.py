@@ -1,13 +1,15 @@
 import streamlit as st
 from streamlit_option_menu import option_menu
-from page1_id_selection import id_selection_page
-from page2_image_viewer import image_viewer_page
-from page3_stl_viewer import stl_viewer_page
-from page4_maps_comparaison import comp_viewer_page
+from memory_cache import cache_stats
+from page_loader import PAGES, import_report, load_page, start_warmup
+from tracing import finish_rerun, records_to_jsonl, start_rerun, trace
 import os
 
 st.set_page_config(page_title='OAI Data Viewer', layout="wide")
 
+# Reruns kept for the timings export
+TRACE_HISTORY = 50
+
 def main():
     # Initialize session state for data path
     if "data_path" not in st.session_state:
@@ -28,25 +30,63 @@ def main():
                 st.rerun()
             else:
                 st.error("Invalid path. Please enter a valid directory path.")
+        start_warmup()
         return
 
     # Main navigation menu
     selected = option_menu(
         None, 
-        ["ID Selection", "DESS Segmentation", "Model Viewer", "Comparaison of maps"],
+        list(PAGES),
         menu_icon="cast", 
         default_index=0, 
         orientation="horizontal"
     )
 
-    if selected == "ID Selection":
-        id_selection_page()
-    elif selected == "DESS Segmentation":
-        image_viewer_page()
-    elif selected == 'Model Viewer':
-        stl_viewer_page()
-    else:
-        comp_viewer_page()
+    start_rerun(selected)
+    # The page module, and its heavy dependencies, are imported on first selection
+    with trace(f"import: {selected}"):
+        page = load_page(selected)
+    with trace(f"page: {selected}"):
+        page()
+    # Kept per session for the timings panel, and appended to $OAI_TRACE_FILE when set
+    trace_history = st.session_state.setdefault('trace_history', [])
+    trace_history.append(finish_rerun())
+    del trace_history[:-TRACE_HISTORY]
+
+    with st.sidebar.expander("Cache Statistics"):
+        stats = cache_stats()
+        st.write(f"{stats['bytes'] / 1024 ** 2:.0f} / {stats['budget'] / 1024 ** 2:.0f} MB in {stats['entries']} entries")
+        st.write(f"Hits: {stats['hits']}, misses: {stats['misses']}, evictions: {stats['evictions']} "
+                 f"(hit rate {stats['hit_rate']:.0%})")
+
+    with st.sidebar.expander("Rerun Timings"):
+        record = trace_history[-1]
+        st.write(f"{record['page']}: {record['wall_s'] * 1000:.0f} ms")
+        st.dataframe([{
+            'span': '  ' * span['depth'] + name,
+            'calls': span['calls'],
+            'ms': round(span['wall_s'] * 1000, 1),
+            'MB read': round(span['bytes_read'] / 1024 ** 2, 1),
+            'cache hits': span['cache_hits'],
+            'cache misses': span['cache_misses'],
+            'RSS delta (MB)': round(span['rss_delta'] / 1024 ** 2, 1),
+        } for name, span in record['spans'].items()], hide_index=True)
+        st.download_button("Export JSONL", records_to_jsonl(trace_history), file_name="oai_trace.jsonl",
+                           mime="application/jsonl")
+
+    with st.sidebar.expander("Startup"):
+        report, warmup_status = import_report()
+        st.write(f"Background warm-up: {warmup_status}")
+        st.dataframe([{
+            'module': module,
+            'import (s)': round(entry['seconds'], 2) if 'seconds' in entry else None,
+            'new modules': entry.get('new_modules'),
+            'imported by': entry['source'],
+            'error': entry.get('error'),
+        } for module, entry in report.items()], hide_index=True)
+
+    # The remaining pages are imported in the background once this page has been sent
+    start_warmup()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,27 @@
+import json
+import os
+from cohort_index import get_cache_dir
+
+# Paths and progress log of the QC atlas, kept apart from batch_render so the atlas page does not import the renderers
+PROGRESS_FILENAME = 'progress.jsonl'
+
+def atlas_dir(data_path):
+    return get_cache_dir(data_path, 'atlas')
+
+def atlas_paths(data_path, subject_id, time_point):
+    subject_dir = os.path.join(atlas_dir(data_path), str(subject_id))
+    return {
+        'slice': os.path.join(subject_dir, f"{time_point}_sagittal.png"),
+        'femur': os.path.join(subject_dir, f"{time_point}_femur.png"),
+        'tibia': os.path.join(subject_dir, f"{time_point}_tibia.png"),
+    }
+
+def read_progress(data_path):
+    done = {}
+    path = os.path.join(atlas_dir(data_path), PROGRESS_FILENAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                done[(record['id'], record['time_point'])] = record
+    return done
@@ -0,0 +1,112 @@
+import argparse
+import base64
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import nibabel as nib
+import pyvista as pv
+from atlas_store import PROGRESS_FILENAME, atlas_dir, atlas_paths, read_progress
+from cohort_index import TIME_POINTS, BONES, list_ids, lookup
+from mesh_store import mesh_with_scalars
+from thickness_store import load_thickness
+from thickness_stats import get_clim
+from page2_image_viewer import plot_slice
+from page3_stl_viewer import create_custom_colormap
+
+SNAPSHOT_SIZE = [400, 400]
+
+def render_mid_sagittal(image_path, mask_path, output_path, window_center, window_width):
+    image_img = nib.load(image_path)
+    mask_img = nib.load(mask_path)
+    mid = image_img.shape[0] // 2
+    # Only the mid-sagittal plane is pulled through the proxy
+    slice_data = np.asanyarray(image_img.dataobj[mid, :, :]).astype(np.float32)
+    p1, p99 = np.percentile(slice_data, (1, 99))
+    slice_data = (np.clip(slice_data, p1, p99) - p1) / max(p99 - p1, 1e-6)
+    mask_slice = np.asanyarray(mask_img.dataobj[mid, :, :])
+    spacing = image_img.header.get_zooms()[:3]
+
+    img_str = plot_slice(slice_data, mask_slice, (spacing[1], spacing[2]), window_center=window_center,
+                         window_width=window_width, show_mask=True)
+    with open(output_path, 'wb') as f:
+        f.write(base64.b64decode(img_str))
+
+def render_thickness_snapshot(data_path, subject_id, time_point, bone, output_path):
+    stl_path = os.path.join(data_path, 'DATA', bone + '_ref_final.stl')
+    mesh = mesh_with_scalars(stl_path, load_thickness(data_path, subject_id, time_point, bone))
+
+    plotter = pv.Plotter(off_screen=True, window_size=SNAPSHOT_SIZE)
+    plotter.background_color = 'black'
+    plotter.add_mesh(mesh, scalars='thickness', cmap=create_custom_colormap(), clim=get_clim(data_path, subject_id, bone),
+                     show_scalar_bar=True, nan_color='grey')
+    plotter.add_text(f"{subject_id} {time_point} - {bone}", position='upper_left', font_size=10, color='white')
+    plotter.view_isometric()
+    plotter.screenshot(output_path)
+    plotter.close()
+
+def render_visit(data_path, subject_id, time_point, window_center=0.5, window_width=0.5):
+    paths = atlas_paths(data_path, subject_id, time_point)
+    os.makedirs(os.path.dirname(paths['slice']), exist_ok=True)
+    outputs = {}
+
+    image_path = lookup(data_path, subject_id, time_point, 'dess')
+    mask_path = lookup(data_path, subject_id, time_point, 'pred')
+    if image_path and mask_path:
+        render_mid_sagittal(image_path, mask_path, paths['slice'], window_center, window_width)
+        outputs['slice'] = paths['slice']
+
+    for bone in BONES:
+        try:
+            render_thickness_snapshot(data_path, subject_id, time_point, bone, paths[bone])
+            outputs[bone] = paths[bone]
+        except FileNotFoundError:
+            continue
+    return {'id': subject_id, 'time_point': time_point, 'status': 'done', 'outputs': outputs}
+
+def _render_task(args):
+    # Set in the worker rather than at import, so importing this module leaves interactive sessions alone
+    pv.OFF_SCREEN = True
+    data_path, subject_id, time_point, window_center, window_width = args
+    try:
+        return render_visit(data_path, subject_id, time_point, window_center, window_width)
+    except Exception as e:
+        return {'id': subject_id, 'time_point': time_point, 'status': 'error', 'error': repr(e)}
+
+def run_batch(data_path, workers=None, ids=None, retry_errors=False, window_center=0.5, window_width=0.5):
+    done = read_progress(data_path)
+    tasks = []
+    for subject_id in ids or list_ids(data_path):
+        for time_point in TIME_POINTS:
+            record = done.get((subject_id, time_point))
+            if record is not None and (record['status'] == 'done' or not retry_errors):
+                continue
+            if lookup(data_path, subject_id, time_point, 'processed') is None:
+                continue
+            tasks.append((data_path, subject_id, time_point, window_center, window_width))
+
+    print(f"{len(tasks)} visits to render, {len(done)} already in the atlas")
+    progress_path = os.path.join(atlas_dir(data_path), PROGRESS_FILENAME)
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(progress_path, 'a') as progress:
+        futures = [executor.submit(_render_task, task) for task in tasks]
+        for i, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            # One line per finished visit, so an interrupted run resumes where it stopped
+            progress.write(json.dumps(record) + '\n')
+            progress.flush()
+            print(f"[{i}/{len(tasks)}] {record['id']} {record['time_point']}: {record['status']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Render QC thumbnails and thickness snapshots for the whole cohort")
+    parser.add_argument('data_path', help="Path to the data folder (e.g. /media/chuv/T7)")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--ids', type=int, nargs='*', help="Only render these IDs")
+    parser.add_argument('--retry-errors', action='store_true', help="Render again the visits that failed before")
+    parser.add_argument('--window-center', type=float, default=0.5)
+    parser.add_argument('--window-width', type=float, default=0.5)
+    args = parser.parse_args()
+    pv.OFF_SCREEN = True
+    run_batch(args.data_path, args.workers, args.ids, args.retry_errors, args.window_center, args.window_width)
+
+if __name__ == '__main__':
+    main()
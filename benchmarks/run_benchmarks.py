@@ -0,0 +1,209 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Slower than this many times the baseline warm time is reported as a regression
+REGRESSION_RATIO = 1.25
+
+PAGE_SCRIPT = """
+import sys
+sys.path.insert(0, {repo_dir!r})
+from {module} import {function}
+{function}()
+"""
+
+PAGES = {
+    'page_id_selection': ('page1_id_selection', 'id_selection_page'),
+    'page_dess_segmentation': ('page2_image_viewer', 'image_viewer_page'),
+    'page_model_viewer': ('page3_stl_viewer', 'stl_viewer_page'),
+    'page_comparaison_of_maps': ('page4_maps_comparaison', 'comp_viewer_page'),
+}
+
+# Every case gets the run context and returns the zero-argument call that is timed; imports and setup are not timed
+
+def case_get_all_ids(ctx):
+    import streamlit as st
+    from page1_id_selection import get_all_ids
+    st.session_state.data_path = ctx['data_path']
+    return get_all_ids
+
+def case_id_table(ctx):
+    from id_table import filter_ids, get_id_table
+
+    def run():
+        table = filter_ids(get_id_table(ctx['data_path']), 'KL_00m', [2, 3, 4], ['00m'])
+        return table.slice(0, 50).to_pandas()
+    return run
+
+def case_volume_plane(ctx):
+    # The DESS page path: cached volume, histogram statistics, one normalised plane
+    from cohort_index import get_cache_dir, lookup
+    from volume_access import normalize_slice, open_volume, read_plane
+    from volume_stats import get_volume_stats
+    path = lookup(ctx['data_path'], ctx['subject_id'], ctx['time_point'], 'dess')
+
+    def run():
+        volume = open_volume(path, get_cache_dir(ctx['data_path'], 'volumes'))
+        volume.update(get_volume_stats(ctx['data_path'], volume))
+        return normalize_slice(read_plane(volume, 'Sagittal', volume['shape'][0] // 2), volume['p1'], volume['p99'])
+    return run
+
+def _slice_args(ctx):
+    from cohort_index import get_cache_dir, lookup
+    from volume_access import normalize_slice, open_volume, plane_spacing, read_plane
+    volumes_dir = get_cache_dir(ctx['data_path'], 'volumes')
+    image = open_volume(lookup(ctx['data_path'], ctx['subject_id'], ctx['time_point'], 'dess'), volumes_dir)
+    mask = open_volume(lookup(ctx['data_path'], ctx['subject_id'], ctx['time_point'], 'pred'), volumes_dir)
+    index = image['shape'][0] // 2
+    plane = read_plane(image, 'Sagittal', index).astype('float32')
+    return normalize_slice(plane, plane.min(), plane.max()), read_plane(mask, 'Sagittal', index), plane_spacing(image['spacing'], 'Sagittal')
+
+def case_plot_slice_fast(ctx):
+    from page2_image_viewer import plot_slice
+    slice_data, mask_slice, spacing = _slice_args(ctx)
+    return lambda: plot_slice(slice_data, mask_slice, spacing, renderer='fast')
+
+def case_plot_slice_matplotlib(ctx):
+    from page2_image_viewer import plot_slice
+    slice_data, mask_slice, spacing = _slice_args(ctx)
+    return lambda: plot_slice(slice_data, mask_slice, spacing, renderer='matplotlib')
+
+def case_load_and_process_mesh(ctx):
+    import streamlit as st
+    from page3_stl_viewer import load_and_process_mesh
+    st.session_state.data_path = ctx['data_path']
+    stl_path = os.path.join(ctx['data_path'], 'DATA', 'femur_ref_final.stl')
+    return lambda: load_and_process_mesh(stl_path, ctx['subject_id'], ctx['time_point'], 'femur')
+
+def page_case(module, function):
+    def case(ctx):
+        from streamlit.testing.v1 import AppTest
+
+        def run():
+            app = AppTest.from_string(PAGE_SCRIPT.format(repo_dir=REPO_DIR, module=module, function=function),
+                                      default_timeout=300)
+            app.session_state.data_path = ctx['data_path']
+            app.session_state.selected_id = ctx['subject_id']
+            app.run()
+            if app.exception:
+                raise RuntimeError(app.exception[0].message)
+        return run
+    return case
+
+CASES = {
+    'get_all_ids': case_get_all_ids,
+    'id_table': case_id_table,
+    'volume_plane': case_volume_plane,
+    'plot_slice_fast': case_plot_slice_fast,
+    'plot_slice_matplotlib': case_plot_slice_matplotlib,
+    'load_and_process_mesh': case_load_and_process_mesh,
+}
+CASES.update({name: page_case(*page) for name, page in PAGES.items()})
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _run_case(name, ctx, repeat):
+    # Runs in a fresh process, so the first call is cold for the in-memory caches and the peak RSS is the case's own
+    record = {'case': name}
+    try:
+        run = CASES[name](ctx)
+        record['setup_rss_mb'] = _peak_rss_mb()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        record['first_s'] = timings[0]
+        record['warm_s'] = statistics.median(timings[1:]) if len(timings) > 1 else timings[0]
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+        record['traceback'] = traceback.format_exc()
+    record['peak_rss_mb'] = _peak_rss_mb()
+    return record
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def _read_baseline(path):
+    baseline = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if 'warm_s' in record:
+                baseline[record['case']] = record
+    return baseline
+
+def run_benchmarks(data_path, names, repeat, subject_id=None, time_point='00m'):
+    from cohort_index import list_ids
+    ctx = {'data_path': data_path, 'subject_id': subject_id or list_ids(data_path)[0], 'time_point': time_point}
+    mp_context = multiprocessing.get_context('spawn')
+    records = []
+    for name in names:
+        with mp_context.Pool(1) as pool:
+            record = pool.apply(_run_case, (name, ctx, repeat))
+        record.update({'revision': _git_revision(), 'timestamp': time.time(), 'repeat': repeat})
+        records.append(record)
+        if 'error' in record:
+            print(f"{name:28s} ERROR {record['error']}")
+        else:
+            print(f"{name:28s} first {record['first_s'] * 1000:9.1f} ms   warm {record['warm_s'] * 1000:9.1f} ms   "
+                  f"peak RSS {record['peak_rss_mb']:7.0f} MB")
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the loading and rendering hot paths on a synthetic or real cohort")
+    parser.add_argument('--data-path', help="Existing data folder; a synthetic cohort is generated when omitted")
+    parser.add_argument('--subjects', type=int, default=5, help="Size of the generated cohort")
+    parser.add_argument('--shape', type=int, nargs=3, default=[192, 192, 80], help="Generated volume shape")
+    parser.add_argument('--cases', nargs='*', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="Append the results to this JSONL file")
+    parser.add_argument('--baseline', help="JSONL file of an earlier run to compare the warm timings against")
+    args = parser.parse_args()
+
+    temp_dir = None
+    data_path = args.data_path
+    if data_path is None:
+        from synthetic_data import generate
+        temp_dir = tempfile.mkdtemp(prefix='oai_bench_')
+        data_path = temp_dir
+        generate(data_path, args.subjects, tuple(args.shape))
+    try:
+        records = run_benchmarks(data_path, args.cases, args.repeat)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            for record in records:
+                f.write(json.dumps({key: value for key, value in record.items() if key != 'traceback'}) + '\n')
+    if args.baseline:
+        baseline = _read_baseline(args.baseline)
+        regressions = [(record['case'], record['warm_s'] / baseline[record['case']]['warm_s']) for record in records
+                       if 'warm_s' in record and record['case'] in baseline and baseline[record['case']]['warm_s'] > 0]
+        for name, ratio in regressions:
+            print(f"{name:28s} {ratio:5.2f}x baseline{'  <-- regression' if ratio > REGRESSION_RATIO else ''}")
+        if any(ratio > REGRESSION_RATIO for _, ratio in regressions):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
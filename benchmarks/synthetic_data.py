@@ -0,0 +1,90 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import nibabel as nib
+import pyvista as pv
+
+TIME_POINTS = ['00m', '12m', '24m', '48m', '72m']
+BONES = ['femur', 'tibia']
+VISIT_DATES = {'00m': '20050101', '12m': '20060101', '24m': '20070101', '48m': '20090101', '72m': '20110101'}
+FIRST_ID = 9000001
+
+def visit_name(subject_id, time_point):
+    return f"{subject_id}_{VISIT_DATES[time_point]}_SAG_3D_DESS_LEFT"
+
+def write_reference_meshes(data_path, resolution):
+    # Two closed surfaces standing in for the femur and tibia templates; returns their vertex counts
+    n_points = {}
+    for bone, center in zip(BONES, [(0, 0, 20), (0, 0, -20)]):
+        path = os.path.join(data_path, 'DATA', bone + '_ref_final.stl')
+        pv.ParametricEllipsoid(30, 25, 15, u_res=resolution, v_res=resolution).translate(center).triangulate().save(path)
+        n_points[bone] = pv.read(path).n_points
+    return n_points
+
+def synthetic_volumes(shape, rng):
+    # Two ellipsoidal "bones" with a cartilage shell each, on a noisy background
+    grid = np.stack(np.meshgrid(*[np.linspace(-1, 1, n, dtype=np.float32) for n in shape], indexing='ij'))
+    mask = np.zeros(shape, dtype=np.uint8)
+    image = rng.normal(150, 40, shape).astype(np.float32)
+    for label, center in ((1, 0.45), (3, -0.45)):
+        radius = np.sqrt(grid[0] ** 2 + ((grid[1] - center) / 0.4) ** 2 + grid[2] ** 2)
+        mask[(radius < 0.75) & (radius >= 0.6)] = label + 1
+        mask[radius < 0.6] = label
+    image[mask % 2 == 1] += 350
+    image[(mask > 0) & (mask % 2 == 0)] += 650
+    return np.clip(image, 0, None).astype(np.int16), mask
+
+def write_visit(data_path, subject_id, time_point, n_points, shape, rng):
+    name = visit_name(subject_id, time_point)
+    processed_dir = os.path.join(data_path, 'DATA', 'processed_PP', time_point, name)
+    os.makedirs(processed_dir, exist_ok=True)
+    for bone in BONES:
+        # Thinning cartilage with a few NaN vertices, as in the real exports
+        thickness = rng.gamma(6, 0.35, n_points[bone]) - 0.05 * TIME_POINTS.index(time_point)
+        thickness[rng.random(n_points[bone]) < 0.02] = np.nan
+        np.savetxt(os.path.join(processed_dir, f"{name}_{bone}_cartThickness.txt"), thickness, fmt='%.4f')
+
+    image, mask = synthetic_volumes(shape, rng)
+    affine = np.diag([0.36, 0.36, 0.7, 1.0])
+    nib.save(nib.Nifti1Image(image, affine), os.path.join(data_path, 'IMAGE', time_point, f"DESS_{time_point}", f"{name}_0000.nii.gz"))
+    nib.save(nib.Nifti1Image(mask, affine), os.path.join(data_path, 'DATA', 'pred', f"pred_{time_point.lower()}_PP", f"{name}.nii.gz"))
+
+def generate(data_path, n_subjects, shape=(96, 96, 48), mesh_resolution=100, visit_fraction=0.9, seed=0):
+    rng = np.random.default_rng(seed)
+    for time_point in TIME_POINTS:
+        os.makedirs(os.path.join(data_path, 'DATA', 'processed_PP', time_point), exist_ok=True)
+        os.makedirs(os.path.join(data_path, 'IMAGE', time_point, f"DESS_{time_point}"), exist_ok=True)
+        os.makedirs(os.path.join(data_path, 'DATA', 'pred', f"pred_{time_point.lower()}_PP"), exist_ok=True)
+    n_points = write_reference_meshes(data_path, mesh_resolution)
+
+    subject_ids = list(range(FIRST_ID, FIRST_ID + n_subjects))
+    kl_rows = []
+    for subject_id in subject_ids:
+        grade = int(rng.integers(0, 5))
+        kl_row = {'ID': subject_id}
+        for i, time_point in enumerate(TIME_POINTS):
+            # Baseline always exists, later visits are sometimes missed
+            if i > 0 and rng.random() > visit_fraction:
+                kl_row[f"KL_{time_point}"] = np.nan
+                continue
+            write_visit(data_path, subject_id, time_point, n_points, shape, rng)
+            grade = min(4, grade + int(rng.random() < 0.1))
+            kl_row[f"KL_{time_point}"] = grade
+        kl_rows.append(kl_row)
+    pd.DataFrame(kl_rows).to_csv(os.path.join(data_path, 'DATA', 'processed_PP', 'OAI_KL.csv'), index=False)
+    return subject_ids
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic cohort with the OAI data layout")
+    parser.add_argument('data_path', help="Output folder, used as the app's data path")
+    parser.add_argument('--subjects', type=int, default=5)
+    parser.add_argument('--shape', type=int, nargs=3, default=[96, 96, 48], help="DESS / mask volume shape")
+    parser.add_argument('--mesh-resolution', type=int, default=100, help="Reference surface resolution")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    subject_ids = generate(args.data_path, args.subjects, tuple(args.shape), args.mesh_resolution, seed=args.seed)
+    print(f"Wrote {len(subject_ids)} subjects to {args.data_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import os
+import numpy as np
+import pandas as pd
+from cohort_index import TIME_POINTS, BONES, KL_GRADES, get_cache_dir
+from memory_cache import load_file
+from thickness_store import open_thickness_store
+
+# OAI visit codes, used to find the KL column of a time point
+VISIT_CODES = {'00m': 'V00', '12m': 'V01', '24m': 'V03', '48m': 'V06', '72m': 'V08'}
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Per-vertex histogram sketch used for the quantiles
+N_BINS = 32
+MAX_THICKNESS = 8.0  # mm
+
+COHORT_SCALARS = {
+    'KL cohort mean': 'cohort_mean',
+    'z-score vs KL cohort': 'zscore',
+}
+
+def _read_kl_table(path):
+    return pd.read_csv(path).drop_duplicates('ID').set_index('ID')
+
+def load_kl_table(data_path):
+    # Parsed once per version of the sheet, page reruns only look the grade up
+    return load_file('kl_table', os.path.join(data_path, 'DATA/processed_PP/OAI_KL.csv'), _read_kl_table)
+
+def kl_column_for(columns, time_point):
+    kl_columns = [col for col in columns if col.startswith('KL_')]
+    for col in kl_columns:
+        if time_point in col or VISIT_CODES[time_point] in col:
+            return col
+    return kl_columns[0] if kl_columns else None
+
+def subject_kl_grade(data_path, subject_id, time_point):
+    kl_table = load_kl_table(data_path)
+    column = kl_column_for(kl_table.columns, time_point)
+    if column is None or int(subject_id) not in kl_table.index:
+        return None
+    grade = kl_table.at[int(subject_id), column]
+    return None if pd.isna(grade) else int(grade)
+
+def aggregate_path(data_path, bone, time_point, grade):
+    return os.path.join(get_cache_dir(data_path, 'aggregates'), f"{bone}_{time_point}_KL{grade}.npz")
+
+def _new_accumulator(n_vertices):
+    return {
+        'count': np.zeros(n_vertices, dtype=np.int64),
+        'mean': np.zeros(n_vertices, dtype=np.float64),
+        'm2': np.zeros(n_vertices, dtype=np.float64),
+        'hist': np.zeros((n_vertices, N_BINS), dtype=np.uint32),
+    }
+
+def _update(acc, thickness):
+    # Welford update on the vertices that have a value for this subject
+    valid = np.flatnonzero(~np.isnan(thickness))
+    x = thickness[valid].astype(np.float64)
+    acc['count'][valid] += 1
+    delta = x - acc['mean'][valid]
+    acc['mean'][valid] += delta / acc['count'][valid]
+    acc['m2'][valid] += delta * (x - acc['mean'][valid])
+    # Each vertex appears once per subject, so fancy-index increments do not collide
+    bins = np.clip((x * (N_BINS / MAX_THICKNESS)).astype(np.intp), 0, N_BINS - 1)
+    acc['hist'][valid, bins] += 1
+
+def _sketch_quantiles(hist, count):
+    cumulative = np.cumsum(hist, axis=1)
+    bin_width = MAX_THICKNESS / N_BINS
+    quantiles = np.full((len(QUANTILES), len(count)), np.nan, dtype=np.float32)
+    for i, q in enumerate(QUANTILES):
+        target = q * count
+        index = np.minimum((cumulative < target[:, None]).sum(axis=1), N_BINS - 1)
+        below = np.where(index > 0, cumulative[np.arange(len(count)), index - 1], 0)
+        in_bin = hist[np.arange(len(count)), index]
+        fraction = np.divide(target - below, in_bin, out=np.zeros(len(count)), where=in_bin > 0)
+        quantiles[i] = np.where(count > 0, (index + np.clip(fraction, 0, 1)) * bin_width, np.nan)
+    return quantiles
+
+def _save(path, acc):
+    count = acc['count']
+    std = np.sqrt(np.divide(acc['m2'], count - 1, out=np.full(len(count), np.nan), where=count > 1))
+    np.savez(path, count=count.astype(np.int32), mean=np.where(count > 0, acc['mean'], np.nan).astype(np.float32),
+             std=std.astype(np.float32), quantiles=_sketch_quantiles(acc['hist'], count),
+             quantile_levels=np.array(QUANTILES))
+
+def build_cohort_aggregates(data_path, bones=BONES, time_points=TIME_POINTS):
+    kl_table = load_kl_table(data_path)
+    for bone in bones:
+        store, entries = open_thickness_store(data_path, bone)
+        if store is None:
+            raise FileNotFoundError(f"No thickness store for {bone}, run thickness_store.py first")
+        for time_point in time_points:
+            column = kl_column_for(kl_table.columns, time_point)
+            if column is None:
+                raise ValueError("OAI_KL.csv has no KL_ column")
+            tp_index = TIME_POINTS.index(time_point)
+            # One accumulator per KL stratum, the thickness store is walked one subject at a time
+            accumulators = {grade: _new_accumulator(store.shape[2]) for grade in KL_GRADES}
+            for (subject_id, entry_time_point), (row, _, _) in entries.items():
+                if entry_time_point != time_point or subject_id not in kl_table.index:
+                    continue
+                grade = kl_table.at[subject_id, column]
+                if pd.isna(grade) or int(grade) not in accumulators:
+                    continue
+                _update(accumulators[int(grade)], np.asarray(store[row, tp_index]))
+            for grade, acc in accumulators.items():
+                _save(aggregate_path(data_path, bone, time_point, grade), acc)
+            print(f"{bone} {time_point}: " + ", ".join(f"KL{g}={acc['count'].max()}" for g, acc in accumulators.items()))
+
+def load_aggregate(data_path, bone, time_point, grade):
+    path = aggregate_path(data_path, bone, time_point, grade)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as aggregate:
+        return {name: aggregate[name] for name in aggregate.files}
+
+def zscore(thickness, aggregate):
+    std = aggregate['std']
+    return np.divide(np.asarray(thickness, dtype=np.float32) - aggregate['mean'], std,
+                     out=np.full(len(std), np.nan, dtype=np.float32), where=std > 0)
+
+def add_cohort_arrays(mesh, thickness, aggregate):
+    mesh.point_data['cohort_mean'] = aggregate['mean']
+    mesh.point_data['zscore'] = zscore(thickness, aggregate)
+    return mesh
+
+if __name__ == '__main__':
+    import sys
+    build_cohort_aggregates(sys.argv[1])
@@ -0,0 +1,199 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from tracing import traced
+
+TIME_POINTS = ['00m', '12m', '24m', '48m', '72m']
+BONES = ['femur', 'tibia']
+KL_GRADES = [0, 1, 2, 3, 4]
+INDEX_FILENAME = 'cohort_index.sqlite'
+
+# Directory mtimes are only re-checked after this many seconds
+REFRESH_INTERVAL = 5.0
+
+# Index, volume copies, statistics and renders go under $OAI_CACHE_DIR/<data folder hash> when set, otherwise
+# under DATA/cache in the data folder, or the user cache directory when the data folder is read-only
+CACHE_DIR = os.environ.get('OAI_CACHE_DIR')
+USER_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'oai_explorer')
+
+_lock = threading.Lock()
+_index_cache = {}
+_last_refresh = {}
+# Source directory mtimes this process last loaded the index at; the sqlite copy is shared with the CLIs
+_seen_mtimes = {}
+_cache_roots = {}
+
+def _data_key(data_path):
+    return hashlib.sha1(os.path.abspath(data_path).encode()).hexdigest()[:16]
+
+def _cache_root(data_path):
+    root = _cache_roots.get(data_path)
+    if root is None:
+        if CACHE_DIR:
+            root = os.path.join(CACHE_DIR, _data_key(data_path))
+        else:
+            root = os.path.join(data_path, 'DATA', 'cache')
+            try:
+                os.makedirs(root, exist_ok=True)
+            except OSError:
+                pass
+            if not os.access(root, os.W_OK):
+                root = os.path.join(USER_CACHE_DIR, _data_key(data_path))
+        _cache_roots[data_path] = root
+    return root
+
+def get_cache_dir(data_path, *parts):
+    cache_dir = os.path.join(_cache_root(data_path), *parts)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def connect_index(data_path):
+    conn = sqlite3.connect(os.path.join(get_cache_dir(data_path), INDEX_FILENAME), timeout=30)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS scanned_dirs (
+            path TEXT PRIMARY KEY,
+            mtime REAL
+        );
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER NOT NULL,
+            time_point TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL,
+            PRIMARY KEY (id, time_point, kind)
+        );
+    """)
+    return conn
+
+def _source_dirs(data_path):
+    for time_point in TIME_POINTS:
+        yield 'processed', time_point, os.path.join(data_path, 'DATA/processed_PP', time_point)
+        yield 'dess', time_point, os.path.join(data_path, 'IMAGE', time_point, f"DESS_{time_point}")
+        yield 'pred', time_point, os.path.join(data_path, 'DATA', 'pred', f"pred_{time_point.lower()}_PP")
+
+def _parse_id(name):
+    try:
+        return int(name.split('_')[0])
+    except ValueError:
+        # Skip entries that don't start with a number
+        return None
+
+def _thickness_path(processed_path, bone):
+    return os.path.join(processed_path, f"{os.path.basename(processed_path)}_{bone}_cartThickness.txt")
+
+def _list_entries(kind, time_point, directory):
+    for name in sorted(os.listdir(directory)):
+        subject_id = _parse_id(name)
+        if subject_id is None:
+            continue
+        path = os.path.join(directory, name)
+        if kind == 'processed':
+            yield subject_id, time_point, kind, path
+            for bone in BONES:
+                thickness_path = _thickness_path(path, bone)
+                if os.path.exists(thickness_path):
+                    yield subject_id, time_point, f"{bone}_thickness", thickness_path
+        elif kind == 'dess' and name.endswith("_SAG_3D_DESS_LEFT_0000.nii.gz"):
+            yield subject_id, time_point, kind, path
+        elif kind == 'pred' and name.endswith("_SAG_3D_DESS_LEFT.nii.gz"):
+            yield subject_id, time_point, kind, path
+
+def _kinds_for(kind):
+    if kind == 'processed':
+        return [kind] + [f"{bone}_thickness" for bone in BONES]
+    return [kind]
+
+def _read_index(conn):
+    index = {}
+    for subject_id, time_point, kind, path in conn.execute('SELECT id, time_point, kind, path FROM entries'):
+        index.setdefault(subject_id, {}).setdefault(time_point, {})[kind] = path
+    return index
+
+@traced()
+def refresh_index(data_path, force=False):
+    with _lock:
+        now = time.monotonic()
+        if not force and data_path in _index_cache and now - _last_refresh[data_path] < REFRESH_INTERVAL:
+            return _index_cache[data_path]
+
+        conn = connect_index(data_path)
+        try:
+            known = dict(conn.execute('SELECT path, mtime FROM scanned_dirs'))
+            seen = _seen_mtimes.get(data_path, {})
+            current = {}
+            changed = False
+            for kind, time_point, directory in _source_dirs(data_path):
+                try:
+                    mtime = os.stat(directory).st_mtime
+                except FileNotFoundError:
+                    mtime = None
+                current[directory] = mtime
+                # Another process may have rescanned into sqlite already, the in-memory copy still has to be reloaded
+                if directory not in seen or seen[directory] != mtime:
+                    changed = True
+                if not force and directory in known and known[directory] == mtime:
+                    continue
+
+                # Only the directory whose mtime moved is rescanned
+                kinds = _kinds_for(kind)
+                conn.execute(
+                    f"DELETE FROM entries WHERE time_point = ? AND kind IN ({', '.join('?' * len(kinds))})",
+                    [time_point] + kinds
+                )
+                if mtime is not None:
+                    conn.executemany('INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?)',
+                                     _list_entries(kind, time_point, directory))
+                conn.execute('INSERT OR REPLACE INTO scanned_dirs VALUES (?, ?)', (directory, mtime))
+                changed = True
+            conn.commit()
+
+            if changed or data_path not in _index_cache:
+                _index_cache[data_path] = _read_index(conn)
+                _seen_mtimes[data_path] = current
+        finally:
+            conn.close()
+
+        _last_refresh[data_path] = now
+        return _index_cache[data_path]
+
+def get_cohort_index(data_path):
+    return refresh_index(data_path)
+
+def list_ids(data_path):
+    index = get_cohort_index(data_path)
+    return sorted(subject_id for subject_id, visits in index.items()
+                  if any('processed' in entry for entry in visits.values()))
+
+def _find_late_thickness(data_path, visit, time_point, kind):
+    # A thickness file written into an existing visit folder does not move the time point folder's mtime,
+    # so a miss is checked against the indexed visit folder and recorded when the file has appeared since
+    processed_path = visit.get('processed')
+    if processed_path is None:
+        return None
+    path = _thickness_path(processed_path, kind[:-len('_thickness')])
+    if not os.path.exists(path):
+        return None
+    with _lock:
+        conn = connect_index(data_path)
+        try:
+            conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                         (_parse_id(os.path.basename(processed_path)), time_point, kind, path))
+            conn.commit()
+        finally:
+            conn.close()
+        visit[kind] = path
+    return path
+
+def lookup(data_path, subject_id, time_point, kind):
+    index = get_cohort_index(data_path)
+    visit = index.get(int(subject_id), {}).get(time_point, {})
+    path = visit.get(kind)
+    if path is None and kind.endswith('_thickness'):
+        path = _find_late_thickness(data_path, visit, time_point, kind)
+    return path
+
+if __name__ == '__main__':
+    import sys
+    cohort = refresh_index(sys.argv[1], force=True)
+    print(f"Indexed {len(cohort)} subjects")
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import SimpleITK as sitk
+from upload_store import CHUNK_SIZE
+
+MAX_WORKERS = int(os.environ.get('OAI_DICOM_WORKERS', min(8, os.cpu_count() or 1)))
+DICOM_CACHE_DIR = os.environ.get('OAI_DICOM_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'oai_explorer', 'dicom'))
+
+# DICOM tags used to order the slices
+SERIES_UID = '0020|000e'
+INSTANCE_NUMBER = '0020|0013'
+IMAGE_POSITION = '0020|0032'
+IMAGE_ORIENTATION = '0020|0037'
+
+def _file_digest(fileobj):
+    fileobj.seek(0)
+    digest = hashlib.sha1()
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.digest()
+
+def series_digest(files):
+    # Content address of a series, independent of file names and upload order
+    return hashlib.sha1(b''.join(sorted(_file_digest(f) for f in files))).hexdigest()
+
+def _tag_values(reader, tag):
+    return np.array([float(v) for v in reader.GetMetaData(tag).split('\\')])
+
+def _read_slice(path, fileobj):
+    fileobj.seek(0)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(fileobj, f, CHUNK_SIZE)
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(path)
+    image = reader.Execute()
+    if reader.HasMetaDataKey(IMAGE_POSITION) and reader.HasMetaDataKey(IMAGE_ORIENTATION):
+        # Distance along the slice normal, as GDCM sorts a series
+        orientation = _tag_values(reader, IMAGE_ORIENTATION)
+        location = float(_tag_values(reader, IMAGE_POSITION) @ np.cross(orientation[:3], orientation[3:]))
+    elif reader.HasMetaDataKey(INSTANCE_NUMBER):
+        location = float(reader.GetMetaData(INSTANCE_NUMBER))
+    else:
+        location = 0.0
+    series = reader.GetMetaData(SERIES_UID).strip() if reader.HasMetaDataKey(SERIES_UID) else ''
+    pixels = sitk.GetArrayFromImage(image).reshape(image.GetHeight(), image.GetWidth())
+    return series, location, pixels, image.GetSpacing()
+
+def _assemble(slices, array_path):
+    # Keep the largest series when several were uploaded together, then write it along the slice normal
+    by_series = defaultdict(list)
+    for series, location, pixels, spacing in slices:
+        by_series[series].append((location, pixels, spacing))
+    series_slices = sorted(max(by_series.values(), key=len), key=lambda s: s[0])
+    locations = np.array([s[0] for s in series_slices])
+    shape = (len(series_slices),) + series_slices[0][1].shape
+    dtype = np.result_type(*[s[1].dtype for s in series_slices])
+    image_np = np.lib.format.open_memmap(array_path + '.tmp.npy', mode='w+', dtype=dtype, shape=shape)
+    for i, (_, pixels, _) in enumerate(series_slices):
+        image_np[i] = pixels
+    image_np.flush()
+    del image_np
+    os.replace(array_path + '.tmp.npy', array_path)
+
+    spacing = series_slices[0][2]
+    if len(locations) > 1 and np.ptp(locations) > 0:
+        slice_spacing = float(np.median(np.diff(locations)))
+    else:
+        slice_spacing = float(spacing[2]) if len(spacing) > 2 else 1.0
+    return list(shape), (float(spacing[0]), float(spacing[1]), slice_spacing)
+
+def ingest_dicom_series(files, cache_dir=DICOM_CACHE_DIR):
+    # files are binary file objects with a name; the volume is stored once per distinct series content
+    os.makedirs(cache_dir, exist_ok=True)
+    digest = series_digest(files)
+    array_path = os.path.join(cache_dir, f"{digest}.npy")
+    meta_path = os.path.join(cache_dir, f"{digest}.json")
+    if not os.path.exists(meta_path):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = [os.path.join(temp_dir, f"{i:05d}_{os.path.basename(f.name)}") for i, f in enumerate(files)]
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+                slices = list(pool.map(_read_slice, paths, files))
+        shape, spacing = _assemble(slices, array_path)
+        del slices
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'shape': shape, 'spacing': spacing, 'n_files': len(files)}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return np.load(array_path, mmap_mode='r'), tuple(meta['spacing'])
+
+if __name__ == '__main__':
+    import sys
+    import time
+    paths = sorted(os.path.join(sys.argv[1], name) for name in os.listdir(sys.argv[1]))
+    files = [open(path, 'rb') for path in paths]
+    start = time.perf_counter()
+    image_np, spacing = ingest_dicom_series(files)
+    print(f"{len(files)} files -> {image_np.shape}, spacing {spacing}, {time.perf_counter() - start:.2f}s")
+    for f in files:
+        f.close()
@@ -1,38 +1,32 @@
 import streamlit as st
-import SimpleITK as sitk
 import numpy as np
 import matplotlib.pyplot as plt
-import tempfile
-import os
-import nibabel as nib
 import base64
 from io import BytesIO
+from dicom_ingest import ingest_dicom_series
+from memory_cache import get_or_load
+from slice_render import IMAGE_MIME, colormap_lut, render_slice
+from upload_store import estimate_percentiles, open_nifti, read_plane, save_upload
+from volume_access import normalize_slice
 
-def load_and_store_dicom_series(directory, session_key):
-    if session_key not in st.session_state:
-        reader = sitk.ImageSeriesReader()
-        dicom_names = reader.GetGDCMSeriesFileNames(directory)
-        reader.SetFileNames(dicom_names)
-        image_sitk = reader.Execute()
-        image_np = sitk.GetArrayFromImage(image_sitk)
-        spacing = image_sitk.GetSpacing()
-        st.session_state[session_key] = (image_np, spacing)
-    return st.session_state[session_key]
-
-def normalize_mri(image):
-    p1, p99 = np.percentile(image, (1, 99))
-    image_normalized = np.clip(image, p1, p99)
-    image_normalized = (image_normalized - p1) / (p99 - p1)
-    return image_normalized
+def load_and_store_dicom_series(uploaded_files, cache_key):
+    # In-memory hit on reruns, content-addressed disk hit when the same series is uploaded again
+    return get_or_load(cache_key, lambda: ingest_dicom_series(uploaded_files))
+
+def upload_cache_key(kind, uploaded_files):
+    # Identifies an upload across reruns, so a replaced upload gets a new key
+    return (kind,) + tuple((f.name, f.size, f.file_id) for f in uploaded_files)
 
 def apply_window(image, window_center, window_width):
     min_val = window_center - window_width / 2
     max_val = window_center + window_width / 2
     return np.clip((image - min_val) / (max_val - min_val), 0, 1)
 
-def plot_slice(slice, mask_slice=None, spacing=None, is_nifti=False, window_center=0.5, window_width=1.0):
+# Same look as imshow(cmap='hot', alpha=0.3) over the mask value range
+HOT_LUT = colormap_lut(plt.cm.hot(np.linspace(0, 1, 256)), alpha=0.3)
+
+def plot_slice(slice, mask_slice=None, spacing=None, is_nifti=False, window_center=0.5, window_width=1.0, renderer='fast', image_format='png'):
     aspect_ratio = spacing[1] / spacing[0] if spacing else 1
-    fig, ax = plt.subplots(figsize=(6, 6))
     
     if is_nifti:
         slice = np.rot90(slice)
@@ -43,6 +37,15 @@ def plot_slice(slice, mask_slice=None, spacing=None, is_nifti=False, window_cent
         if mask_slice is not None:
             mask_slice = mask_slice[::-1, ::-1]
 
+    if renderer == 'fast':
+        if mask_slice is not None:
+            mask_min, mask_max = np.min(mask_slice), np.max(mask_slice)
+            mask_slice = np.zeros(mask_slice.shape, dtype=np.uint8) if mask_max == mask_min else \
+                ((mask_slice - mask_min) * (255.0 / (mask_max - mask_min))).astype(np.uint8)
+        return render_slice(slice, mask_slice, aspect_ratio, window_center, window_width, lut=HOT_LUT, image_format=image_format)
+
+    fig, ax = plt.subplots(figsize=(6, 6))
+
     slice = apply_window(slice, window_center, window_width)
 
     ax.imshow(slice, cmap='gray', aspect=aspect_ratio)
@@ -59,14 +62,6 @@ def plot_slice(slice, mask_slice=None, spacing=None, is_nifti=False, window_cent
     plt.close(fig)
     return base64.b64encode(buf.getvalue()).decode("utf-8")
 
-def load_nifti_file(filepath, session_key):
-    if session_key not in st.session_state:
-        nifti_img = nib.load(filepath)
-        image_np = np.asanyarray(nifti_img.dataobj)
-        spacing = nifti_img.header.get_zooms()[:3]
-        st.session_state[session_key] = (image_np, spacing)
-    return st.session_state[session_key]
-
 def main():
     st.set_page_config(page_title='MRI Viewer', layout="wide")
 
@@ -82,62 +77,48 @@ def main():
     mask_file = st.file_uploader("Choose Mask File (NIfTI)", type=["nii", "nii.gz"], key="mask_uploader")
     
     if uploaded_files:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            is_nifti = False
-            for uploaded_file in uploaded_files:
-                bytes_data = uploaded_file.read()
-                file_path = os.path.join(temp_dir, uploaded_file.name)
-                with open(file_path, 'wb') as f:
-                    f.write(bytes_data)
-                if uploaded_file.name.endswith(('.nii', '.nii.gz')):
-                    is_nifti = True
-            
-            if is_nifti:
-                image_np, spacing = load_nifti_file(file_path, "nifti_image_data")
-            else:
-                image_np, spacing = load_and_store_dicom_series(temp_dir, "dicom_image_data")
-
-        if mask_file:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.nii.gz') as temp_mask_file:
-                temp_mask_file.write(mask_file.getvalue())
-                mask_np, mask_spacing = load_nifti_file(temp_mask_file.name, "mask_data")
-            os.unlink(temp_mask_file.name)
+        nifti_files = [f for f in uploaded_files if f.name.endswith(('.nii', '.nii.gz'))]
+        is_nifti = bool(nifti_files)
+        # Both sources come back memory-mapped; planes are read and normalised only when displayed
+        if is_nifti:
+            image_np, spacing = open_nifti(save_upload(nifti_files[-1]))
         else:
-            mask_np = None
+            image_np, spacing = load_and_store_dicom_series(uploaded_files, upload_cache_key('dicom', uploaded_files))
+        mask_np = open_nifti(save_upload(mask_file))[0] if mask_file else None
 
-        # Normalize the MRI image globally
-        image_np = normalize_mri(image_np)
+        p1, p99 = get_or_load(upload_cache_key('percentiles', uploaded_files), lambda: estimate_percentiles(image_np))
 
         # Add contrast adjustment controls
         st.sidebar.header("Contrast Adjustment")
         window_center = st.sidebar.slider("Window Center", 0.0, 1.0, 0.5, 0.01)
         window_width = st.sidebar.slider("Window Width", 0.0, 1.0, 0.5, 0.01)
 
+        renderer = st.sidebar.radio("Renderer", ["Fast (PNG)", "Fast (WebP)", "Matplotlib"])
+        image_format = 'webp' if renderer == "Fast (WebP)" else 'png'
+
         # View selection
         st.sidebar.header("View Selection")
         view = st.sidebar.radio("Choose view", ["Axial", "Coronal", "Sagittal"])
 
         if view == "Axial":
-            slice_num = st.sidebar.slider("Axial Slice", 0, image_np.shape[2] - 1, image_np.shape[2] // 2)
-            slice_data = image_np[:, :, slice_num]
-            mask_slice = mask_np[:, :, slice_num] if mask_np is not None else None
+            axis = 2
             spacing_2d = (spacing[0], spacing[1])
         elif view == "Coronal":
-            slice_num = st.sidebar.slider("Coronal Slice", 0, image_np.shape[1] - 1, image_np.shape[1] // 2)
-            slice_data = image_np[:, slice_num, :]
-            mask_slice = mask_np[:, slice_num, :] if mask_np is not None else None
+            axis = 1
             spacing_2d = (spacing[0], spacing[2])
         else:  # Sagittal
-            slice_num = st.sidebar.slider("Sagittal Slice", 0, image_np.shape[0] - 1, image_np.shape[0] // 2)
-            slice_data = image_np[slice_num, :, :]
-            mask_slice = mask_np[slice_num, :, :] if mask_np is not None else None
+            axis = 0
             spacing_2d = (spacing[1], spacing[2])
+        slice_num = st.sidebar.slider(f"{view} Slice", 0, image_np.shape[axis] - 1, image_np.shape[axis] // 2)
+        slice_data = normalize_slice(read_plane(image_np, axis, slice_num), p1, p99)
+        mask_slice = read_plane(mask_np, axis, slice_num) if mask_np is not None else None
 
-        img_str = plot_slice(slice_data, mask_slice, spacing_2d, is_nifti=is_nifti, window_center=window_center, window_width=window_width)
+        img_str = plot_slice(slice_data, mask_slice, spacing_2d, is_nifti=is_nifti, window_center=window_center, window_width=window_width,
+                             renderer='matplotlib' if renderer == "Matplotlib" else 'fast', image_format=image_format)
 
         st.markdown(f"""
         <div style="display: flex; justify-content: center; align-items: center; height: 500px;">
-            <img id="mri-image" src="data:image/png;base64,{img_str}" style="max-width: 100%; max-height: 100%; object-fit: contain;">
+            <img id="mri-image" src="data:{IMAGE_MIME[image_format]};base64,{img_str}" style="max-width: 100%; max-height: 100%; object-fit: contain;">
         </div>
         <script>
             function resizeImage() {{
@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from cohort_index import TIME_POINTS, connect_index, get_cache_dir, get_cohort_index, list_ids
+from memory_cache import load_file
+from seg_stats import LABEL_NAMES, cohort_volumes
+
+TABLE_FILENAME = 'id_table.parquet'
+# Structures whose volumes become table columns
+VOLUME_LABELS = [2, 4]
+
+def table_path(data_path):
+    return os.path.join(get_cache_dir(data_path), TABLE_FILENAME)
+
+def _kl_path(data_path):
+    return os.path.join(data_path, 'DATA/processed_PP/OAI_KL.csv')
+
+def _source_signature(data_path):
+    # Changes whenever the KL sheet, the indexed files or the segmentation statistics change
+    conn = connect_index(data_path)
+    try:
+        entries = conn.execute('SELECT COUNT(*), TOTAL(id) FROM entries').fetchone()
+        has_seg_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'seg_stats'").fetchone()
+        seg_stats = conn.execute('SELECT COUNT(*), TOTAL(volume_mm3) FROM seg_stats').fetchone() if has_seg_stats else (0, 0.0)
+    finally:
+        conn.close()
+    return f"{os.stat(_kl_path(data_path)).st_mtime_ns}:{entries}:{seg_stats}"
+
+def volume_column(label, time_point):
+    return f"{LABEL_NAMES[label]} {time_point} (mL)"
+
+def build_id_table(data_path, signature):
+    index = get_cohort_index(data_path)
+    df = pd.read_csv(_kl_path(data_path))
+    # Same rule as list_ids: an ID or visit counts only with a processed visit folder, not with a lone scan
+    df = df[df['ID'].isin(list_ids(data_path))]
+    df = df[['ID'] + [col for col in df.columns if col.startswith('KL_')]].drop_duplicates('ID').reset_index(drop=True)
+
+    for time_point in TIME_POINTS:
+        df[f"has_{time_point}"] = ['processed' in index[subject_id].get(time_point, {}) for subject_id in df['ID']]
+    df['n_visits'] = df[[f"has_{time_point}" for time_point in TIME_POINTS]].sum(axis=1)
+
+    for time_point in TIME_POINTS:
+        volumes = cohort_volumes(data_path, time_point)
+        for label in VOLUME_LABELS:
+            column = f"{LABEL_NAMES[label]} (mL)"
+            df[volume_column(label, time_point)] = df['ID'].map(volumes[column]) if column in volumes else np.nan
+    for label in VOLUME_LABELS:
+        series = df[[volume_column(label, time_point) for time_point in TIME_POINTS]]
+        baseline, last = series.iloc[:, 0], series.ffill(axis=1).iloc[:, -1]
+        df[f"{LABEL_NAMES[label]} change (%)"] = 100 * (last - baseline) / baseline
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({'signature': signature})
+    path = table_path(data_path)
+    pq.write_table(table, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+def get_id_table(data_path):
+    # Rebuilt only when the sources change; reruns read the Parquet file once through the memory cache
+    get_cohort_index(data_path)
+    path = table_path(data_path)
+    signature = _source_signature(data_path)
+    if not os.path.exists(path) or (pq.read_schema(path).metadata or {}).get(b'signature') != signature.encode():
+        build_id_table(data_path, signature)
+    return load_file('id_table', path, pq.read_table)
+
+def metric_columns(table):
+    return [name for name in table.column_names
+            if name == 'n_visits' or name.endswith('(mL)') or name.endswith('(%)')]
+
+def column_range(table, column):
+    bounds = pc.min_max(table.column(column))
+    low, high = bounds['min'].as_py(), bounds['max'].as_py()
+    return (None, None) if low is None else (float(low), float(high))
+
+def filter_ids(table, kl_column=None, kl_grades=(), time_points=(), metric=None, metric_range=None, search=''):
+    # Every filter is an Arrow expression, evaluated in one pass without converting the table
+    expression = pc.scalar(True)
+    if kl_column and kl_grades:
+        expression &= pc.field(kl_column).isin(pa.array(kl_grades, type=table.schema.field(kl_column).type))
+    for time_point in time_points:
+        expression &= pc.field(f"has_{time_point}")
+    if metric and metric_range:
+        expression &= (pc.field(metric) >= metric_range[0]) & (pc.field(metric) <= metric_range[1])
+    if search:
+        expression &= pc.starts_with(pc.field('ID').cast(pa.string()), search.strip())
+    return table.filter(expression)
@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Shared by every Streamlit session served by this process
+CACHE_BUDGET = int(os.environ.get('OAI_CACHE_BYTES', 2 * 1024 ** 3))
+# Memory-mapped arrays are limited by count instead, their pages belong to the OS page cache
+MAX_MAPPED = int(os.environ.get('OAI_CACHE_MAPPED', 64))
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_state = {'budget': CACHE_BUDGET, 'bytes': 0, 'mapped': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+
+def sizeof(value):
+    if isinstance(value, np.memmap):
+        # Hardly any of it is resident
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, 'indptr'):
+        # scipy sparse matrices, e.g. the LOD projections
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if hasattr(value, 'nbytes'):
+        # pyarrow tables, e.g. the ID table
+        return value.nbytes
+    if hasattr(value, 'actual_memory_size'):
+        # pyvista datasets report their size in kibibytes
+        return value.actual_memory_size * 1024
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+def _evict():
+    while _state['bytes'] > _state['budget'] and len(_entries) > 1:
+        _remove(next(iter(_entries)))
+        _state['evictions'] += 1
+    if _state['mapped'] > MAX_MAPPED:
+        for key in [key for key, (value, _) in _entries.items() if isinstance(value, np.memmap)][:_state['mapped'] - MAX_MAPPED]:
+            _remove(key)
+            _state['evictions'] += 1
+
+def _remove(key):
+    value, size = _entries.pop(key)
+    _state['bytes'] -= size
+    _state['mapped'] -= isinstance(value, np.memmap)
+
+def get_or_load(key, loader):
+    with _lock:
+        if key in _entries:
+            _entries.move_to_end(key)
+            _state['hits'] += 1
+            return _entries[key][0]
+        _state['misses'] += 1
+
+    value = loader()
+    size = sizeof(value)
+    with _lock:
+        if key in _entries:
+            _remove(key)
+        _entries[key] = (value, size)
+        _state['bytes'] += size
+        _state['mapped'] += isinstance(value, np.memmap)
+        _evict()
+    return value
+
+def file_key(kind, path):
+    stat = os.stat(path)
+    return (kind, os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def load_file(kind, path, loader):
+    key = file_key(kind, path)
+    with _lock:
+        # Drop entries for older versions of the same file
+        for stale in [k for k in _entries if k[:2] == key[:2] and k != key]:
+            _remove(stale)
+    return get_or_load(key, lambda: loader(path))
+
+def set_cache_budget(n_bytes):
+    with _lock:
+        _state['budget'] = n_bytes
+        _evict()
+
+def clear_cache():
+    with _lock:
+        _entries.clear()
+        _state['bytes'] = 0
+        _state['mapped'] = 0
+
+def cache_stats():
+    with _lock:
+        lookups = _state['hits'] + _state['misses']
+        return dict(_state, entries=len(_entries), hit_rate=_state['hits'] / lookups if lookups else 0.0)
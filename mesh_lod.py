@@ -0,0 +1,79 @@
+import hashlib
+import os
+import numpy as np
+import pyvista as pv
+import scipy.sparse as sparse
+from scipy.spatial import cKDTree
+from cohort_index import get_cache_dir
+from memory_cache import file_key, get_or_load
+from mesh_store import get_reference_mesh
+
+# Fraction of the reference faces kept at each level
+LOD_LEVELS = {'Full': 1.0, '25%': 0.25, '5%': 0.05}
+RESOLUTION_OPTIONS = ['Auto'] + list(LOD_LEVELS)
+N_NEIGHBOURS = 4
+
+def auto_lod_level(n_views):
+    if n_views <= 2:
+        return 'Full'
+    elif n_views <= 10:
+        return '25%'
+    return '5%'
+
+def resolve_lod_level(resolution, n_views):
+    return auto_lod_level(n_views) if resolution == 'Auto' else resolution
+
+def _lod_paths(stl_path, level):
+    # The reference meshes sit in DATA, so the cache follows the data folder's cache root
+    cache_dir = get_cache_dir(os.path.dirname(os.path.dirname(os.path.abspath(stl_path))), 'mesh_lod')
+    stat = os.stat(stl_path)
+    key = hashlib.sha1(f"{os.path.abspath(stl_path)}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:16]
+    prefix = os.path.join(cache_dir, f"{os.path.basename(stl_path)}.{key}.{int(LOD_LEVELS[level] * 100)}")
+    return prefix + '.vtp', prefix + '.npz'
+
+def build_vertex_mapping(coarse_points, fine_points, k=N_NEIGHBOURS):
+    # Inverse-distance weights from each coarse vertex to its k nearest reference vertices
+    distances, indices = cKDTree(fine_points).query(coarse_points, k=k)
+    weights = 1.0 / np.maximum(distances, 1e-9)
+    weights /= weights.sum(axis=1, keepdims=True)
+    rows = np.repeat(np.arange(len(coarse_points)), k)
+    return sparse.csr_matrix((weights.ravel(), (rows, indices.ravel())), shape=(len(coarse_points), len(fine_points)))
+
+def build_lod(stl_path, level):
+    mesh_path, matrix_path = _lod_paths(stl_path, level)
+    if not (os.path.exists(mesh_path) and os.path.exists(matrix_path)):
+        reference = get_reference_mesh(stl_path)
+        coarse = reference.triangulate().decimate(1.0 - LOD_LEVELS[level])
+        coarse.clear_data()
+        matrix = build_vertex_mapping(np.asarray(coarse.points), np.asarray(reference.points))
+        sparse.save_npz(matrix_path, matrix)
+        coarse.save(mesh_path)
+    return pv.read(mesh_path), sparse.load_npz(matrix_path).tocsr()
+
+def get_lod_mesh(stl_path, level):
+    return get_or_load(('lod', level) + file_key('stl', stl_path), lambda: build_lod(stl_path, level))
+
+def project_scalars(matrix, values):
+    # NaN-aware sparse mat-vec: a coarse vertex is NaN when most of its weight comes from NaN vertices
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    weight = matrix @ valid.astype(np.float64)
+    total = matrix @ np.where(valid, values, 0.0)
+    return np.divide(total, weight, out=np.full(len(weight), np.nan), where=weight >= 0.5).astype(np.float32)
+
+def to_lod(mesh, stl_path, level):
+    if level == 'Full':
+        return mesh
+    coarse, matrix = get_lod_mesh(stl_path, level)
+    lod_mesh = coarse.copy(deep=False)
+    for name in mesh.point_data.keys():
+        lod_mesh.point_data[name] = project_scalars(matrix, mesh.point_data[name])
+    return lod_mesh
+
+if __name__ == '__main__':
+    import sys
+    for bone in ['femur', 'tibia']:
+        for level in LOD_LEVELS:
+            if level != 'Full':
+                coarse, _ = build_lod(os.path.join(sys.argv[1], 'DATA', bone + '_ref_final.stl'), level)
+                print(f"{bone} {level}: {coarse.n_points} vertices, {coarse.n_cells} faces")
@@ -0,0 +1,20 @@
+import pyvista as pv
+from memory_cache import load_file
+
+def _read_reference_mesh(stl_path):
+    mesh = pv.read(stl_path)
+    mesh.clear_data()
+    return mesh
+
+def get_reference_mesh(stl_path):
+    # Each reference STL is parsed once and kept in the shared cache, keyed by its mtime
+    return load_file('stl', stl_path, _read_reference_mesh)
+
+def mesh_with_scalars(stl_path, scalars, name='thickness'):
+    reference = get_reference_mesh(stl_path)
+    if len(scalars) != reference.n_points:
+        raise ValueError(f"Got {len(scalars)} values for a mesh with {reference.n_points} vertices: {stl_path}")
+    # Shallow copy shares points and faces with the reference, only the scalars are new
+    mesh = reference.copy(deep=False)
+    mesh.point_data[name] = scalars
+    return mesh
@@ -1,7 +1,8 @@
 import streamlit as st
 import pyvista as pv
 from stpyvista import stpyvista
-import numpy as np
+from thickness_store import read_thickness_file
+from mesh_lod import RESOLUTION_OPTIONS, resolve_lod_level, to_lod
 
 # Set up PyVista for off-screen rendering
 pv.OFF_SCREEN = True
@@ -12,9 +13,7 @@ pv.global_theme.camera['viewup'] = [0.5, 0.5, 1]
 pv.global_theme.camera['position'] = [1, 1, 1]
 
 def load_scalar_from_file(file_path):
-    with open(file_path, 'r') as file:
-        scalars = [float(line.strip()) for line in file]
-    return np.array(scalars)
+    return read_thickness_file(file_path)
 
 def main():
     st.set_page_config(page_title='3D Bone Viewer', layout="wide")
@@ -38,6 +37,9 @@ def main():
     # Add scalars to the mesh
     mesh.point_data['scalars'] = scalars
 
+    resolution = st.sidebar.selectbox("Mesh Resolution", RESOLUTION_OPTIONS)
+    mesh = to_lod(mesh, stl_path, resolve_lod_level(resolution, n_views=1))
+
     # Create a plotter
     plotter = pv.Plotter(off_screen=True)
 
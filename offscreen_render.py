@@ -0,0 +1,107 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import numpy as np
+import pyvista as pv
+import streamlit as st
+from PIL import Image
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Scenes kept alive per session; the least recently shown one is closed beyond this
+MAX_PLOTTERS = int(os.environ.get('OAI_OFFSCREEN_PLOTTERS', 4))
+FRAME_SIZE = [640, 480]
+FRAME_QUALITY = 80
+
+# Streamlit runs every rerun on a new thread, but a VTK render window must stay on the thread that created it,
+# so all plotter work of the process goes through this single thread
+_render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='oai-render')
+
+def _on_render_thread(function, *args):
+    # The caller's script context comes along, so build callbacks can read st.session_state
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    def run():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return function(*args)
+    return _render_executor.submit(run).result()
+
+def _close_scenes(scenes):
+    while scenes:
+        _, scene = scenes.popitem()
+        scene['plotter'].close()
+
+class _PlotterPool:
+    # Closes its plotters on the render thread once the session state holding it is dropped
+    def __init__(self):
+        self.scenes = OrderedDict()
+        # Not at interpreter exit, when the render thread is already gone
+        weakref.finalize(self, _render_executor.submit, _close_scenes, self.scenes).atexit = False
+
+def get_plotter_pool():
+    return st.session_state.setdefault('offscreen_plotters', _PlotterPool()).scenes
+
+def close_plotter_pool():
+    _on_render_thread(_close_scenes, get_plotter_pool())
+
+def _build_scene(key, build, shape, window_size):
+    pool = get_plotter_pool()
+    if key in pool:
+        pool.move_to_end(key)
+        return pool[key]
+    plotter = pv.Plotter(off_screen=True, shape=shape, window_size=window_size)
+    try:
+        build(plotter)
+    except BaseException:
+        plotter.close()
+        raise
+    scene = {'plotter': plotter, 'cameras': [renderer.camera_position for renderer in plotter.renderers]}
+    pool[key] = scene
+    while len(pool) > MAX_PLOTTERS:
+        _, old_scene = pool.popitem(last=False)
+        old_scene['plotter'].close()
+    return scene
+
+def get_scene(key, build, shape=(1, 1), window_size=FRAME_SIZE):
+    # build(plotter) only runs when the scene is not in the pool, camera moves reuse the same plotter
+    return _on_render_thread(_build_scene, key, build, shape, window_size)
+
+def set_camera(scene, azimuth=0.0, elevation=0.0, zoom=1.0):
+    # Absolute orbit around each renderer's initial view; linked views share one camera, so it is moved once
+    moved = set()
+    for renderer, initial in zip(scene['plotter'].renderers, scene['cameras']):
+        if id(renderer.camera) in moved:
+            continue
+        moved.add(id(renderer.camera))
+        renderer.camera_position = initial
+        renderer.camera.Azimuth(azimuth)
+        renderer.camera.Elevation(elevation)
+        renderer.camera.OrthogonalizeViewUp()
+        renderer.camera.Dolly(zoom)
+
+def _screenshot(scene, azimuth, elevation, zoom):
+    set_camera(scene, azimuth, elevation, zoom)
+    scene['plotter'].render()
+    return np.asarray(scene['plotter'].screenshot(return_img=True))
+
+def render_frame(scene, azimuth=0.0, elevation=0.0, zoom=1.0, image_format='jpeg'):
+    rgb = _on_render_thread(_screenshot, scene, azimuth, elevation, zoom)
+    buf = BytesIO()
+    if image_format == 'webp':
+        Image.fromarray(rgb).save(buf, format='WEBP', quality=FRAME_QUALITY, method=0)
+    else:
+        Image.fromarray(rgb).save(buf, format='JPEG', quality=FRAME_QUALITY)
+    return buf.getvalue()
+
+def show_offscreen_scene(key, build, shape=(1, 1), window_size=FRAME_SIZE, controls_key='offscreen'):
+    # Only the encoded frame reaches the browser; the camera sliders rerun the script and re-render server-side
+    scene = get_scene(key, build, shape, window_size)
+    columns = st.columns(3)
+    azimuth = columns[0].slider("Azimuth", -180, 180, 0, 5, key=f"{controls_key}_azimuth")
+    elevation = columns[1].slider("Elevation", -85, 85, 0, 5, key=f"{controls_key}_elevation")
+    zoom = columns[2].slider("Zoom", 0.5, 4.0, 1.0, 0.1, key=f"{controls_key}_zoom")
+    frame = render_frame(scene, azimuth, elevation, zoom)
+    st.image(frame, use_container_width=True)
+    return len(frame)
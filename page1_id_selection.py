@@ -1,54 +1,56 @@
 import streamlit as st
-import pandas as pd
-import os
-from PIL import Image
+from cohort_index import TIME_POINTS, KL_GRADES, list_ids
+from id_table import column_range, filter_ids, get_id_table, metric_columns
+from tracing import trace, traced
 
+@traced()
 def get_all_ids():
-    base_paths = [
-        os.path.join(st.session_state.data_path, 'DATA/processed_PP/00m'),
-        os.path.join(st.session_state.data_path, 'DATA/processed_PP/12m'),
-        os.path.join(st.session_state.data_path, 'DATA/processed_PP/24m'),
-        os.path.join(st.session_state.data_path, 'DATA/processed_PP/48m'),
-        os.path.join(st.session_state.data_path, 'DATA/processed_PP/72m')
-    ]
-    
-    ids_sets = []
-    
-    for base_path in base_paths:
-        ids = set()
-        for folder in os.listdir(base_path):
-            try:
-                id = folder.split('_')[0]
-                ids.add(int(id))
-            except ValueError:
-                # Skip folders that don't start with a number
-                continue
-        ids_sets.append(ids)
-    
-    all_ids = set.union(*ids_sets)
-   
-    return sorted(list(all_ids))
-
-def load_data():
-    df = pd.read_csv(os.path.join(st.session_state.data_path, 'DATA/processed_PP/OAI_KL.csv'))
-    all_ids = get_all_ids()
-    return df[df['ID'].isin(all_ids)]
+    return list_ids(st.session_state.data_path)
 
 def id_selection_page():
     st.title('ID Selection with KLs')
 
-    # Load data
-    df = load_data()
-
-    # Display all IDs with KL values
-    id_df = df[['ID'] + [col for col in df.columns if col.startswith('KL_')]].drop_duplicates()
-    st.dataframe(id_df)
+    # Columnar ID table, rebuilt only when the KL sheet, the indexed files or the segmentation statistics change
+    with trace('get_id_table'):
+        table = get_id_table(st.session_state.data_path)
+
+    with st.sidebar.expander("Filters", expanded=True):
+        kl_columns = [col for col in table.column_names if col.startswith('KL_')]
+        kl_column = st.selectbox('KL column', kl_columns) if kl_columns else None
+        kl_grades = st.multiselect('KL grades', KL_GRADES)
+        time_points = st.multiselect('Visits available', TIME_POINTS)
+        metric = st.selectbox('Metric', ['None'] + metric_columns(table))
+        metric_range = None
+        if metric != 'None':
+            low, high = column_range(table, metric)
+            if low is not None and low < high:
+                metric_range = st.slider(metric, low, high, (low, high))
+                # The full range is no filter, so IDs without a value for this metric are kept
+                if metric_range == (low, high):
+                    metric_range = None
+        search = st.text_input('Search ID')
+
+    filtered = filter_ids(table, kl_column, kl_grades, time_points, None if metric == 'None' else metric, metric_range, search)
+    st.caption(f"{filtered.num_rows} of {table.num_rows} IDs")
+
+    # Only the shown page is converted for display
+    page_size = st.sidebar.selectbox("Rows per page", [25, 50, 100], index=1)
+    n_pages = max(1, (filtered.num_rows + page_size - 1) // page_size)
+    page = st.sidebar.number_input("Page", 1, n_pages, 1)
+    st.dataframe(filtered.slice((page - 1) * page_size, page_size).to_pandas(), hide_index=True)
+
+    ids = filtered.column('ID').to_pylist()
+    st.session_state.id_order = ids
 
     # Select specific ID
-    selected_id = st.selectbox('Choose ID', options=id_df['ID'].unique())
+    selected_id = st.selectbox('Choose ID', options=ids)
 
-    if st.button('Confirm Selection'):
+    if st.button('Confirm Selection', disabled=selected_id is None):
         st.session_state.selected_id = selected_id
+        # Imported here so that the ID page does not load the volume and mesh stack on startup
+        from prefetch import prefetch_neighbours
+        # Warm the caches for this subject's visits and the next subjects in the table
+        prefetch_neighbours(st.session_state.data_path, selected_id, st.session_state.id_order)
         st.success(f"ID {selected_id} selected. You can now proceed to the Image Viewer or STL Viewer.")
 
 # Run the app
@@ -1,24 +1,18 @@
 import streamlit as st
-import SimpleITK as sitk
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
-import os
-import nibabel as nib
 import base64
 from io import BytesIO
-
-def load_nifti_file(filepath):
-    nifti_img = nib.load(filepath)
-    image_np = np.asanyarray(nifti_img.dataobj)
-    spacing = nifti_img.header.get_zooms()[:3]
-    return image_np, spacing
-
-def normalize_mri(image):
-    p1, p99 = np.percentile(image, (1, 99))
-    image_normalized = np.clip(image, p1, p99)
-    image_normalized = (image_normalized - p1) / (p99 - p1)
-    return image_normalized
+from cohort_index import TIME_POINTS, get_cache_dir, lookup
+from prefetch import prefetch_neighbours
+from seg_stats import LABEL_NAMES, get_seg_stats
+from slice_render import IMAGE_MIME, colormap_lut, render_slice
+from slice_stack import build_slice_stack, show_slice_scrubber
+from tracing import trace, traced
+from visit_panels import open_visits, read_visit_planes, visit_slice_count
+from volume_access import VIEW_AXES, normalize_slice, open_volume, plane_spacing, read_plane
+from volume_stats import get_volume_stats
 
 def apply_window(image, window_center, window_width):
     min_val = window_center - window_width / 2
@@ -36,8 +30,17 @@ def create_custom_colormap():
               (0, 1, 0, 0.5)]  # Green with 50% opacity for cartilage
     return mcolors.ListedColormap(colors)
 
-def plot_slice(slice, mask_slice, spacing=None, window_center=0.5, window_width=1.0, show_mask=True):
+SEGMENTATION_LUT = colormap_lut(create_custom_colormap().colors)
+
+@traced()
+def plot_slice(slice, mask_slice, spacing=None, window_center=0.5, window_width=1.0, show_mask=True, renderer='fast', image_format='png'):
     aspect_ratio = spacing[1] / spacing[0] if spacing else 1
+
+    if renderer == 'fast':
+        # Window, LUT and blend with NumPy, skipping Matplotlib figure creation
+        return render_slice(np.rot90(slice), np.rot90(mask_slice) if show_mask else None, aspect_ratio,
+                            window_center, window_width, lut=SEGMENTATION_LUT, image_format=image_format)
+
     fig, ax = plt.subplots(figsize=(6, 6))
 
     slice = np.rot90(slice)
@@ -59,6 +62,44 @@ def plot_slice(slice, mask_slice, spacing=None, window_center=0.5, window_width=
     plt.close(fig)
     return base64.b64encode(buf.getvalue()).decode("utf-8")
 
+def visit_comparison(selected_id):
+    # All visits side by side on one slice index, view and window; volumes are opened and planes read concurrently
+    prefetch_neighbours(st.session_state.data_path, selected_id, st.session_state.get('id_order'))
+    with trace('open_visits'):
+        visits = open_visits(st.session_state.data_path, selected_id, TIME_POINTS)
+    available = [visit for visit in visits.values() if visit]
+    if not available:
+        st.error(f"No image or mask found for ID {selected_id}")
+        return
+
+    st.sidebar.header("Image Adjustment")
+    # Each visit is normalised by its own percentiles, so one window applies to all of them
+    window_center = st.sidebar.slider("Window Center", 0.0, 1.0, available[0]['image']['window_center'], 0.01)
+    window_width = st.sidebar.slider("Window Width", 0.0, 1.0, available[0]['image']['window_width'], 0.01)
+    show_mask = st.sidebar.checkbox("Show Mask", value=True)
+    image_format = 'webp' if st.sidebar.radio("Renderer", ["Fast (PNG)", "Fast (WebP)"]) == "Fast (WebP)" else 'png'
+
+    st.sidebar.header("View Selection")
+    view = st.sidebar.radio("Choose view", ["Sagittal", "Coronal", "Axial"])
+    n_slices = visit_slice_count(visits, view)
+    slice_num = st.sidebar.slider(f"{view} Slice", 0, n_slices - 1, n_slices // 2)
+
+    with trace('read_visit_planes'):
+        planes = read_visit_planes(visits, view, slice_num)
+
+    for column, (time_point, plane) in zip(st.columns(len(planes)), planes.items()):
+        column.subheader(time_point)
+        if plane is None:
+            column.caption("No scan")
+            continue
+        slice_data, mask_slice, spacing_2d, index = plane
+        img_str = plot_slice(slice_data, mask_slice, spacing_2d, window_center=window_center, window_width=window_width,
+                             show_mask=show_mask, image_format=image_format)
+        column.markdown(f'''<img src="data:{IMAGE_MIME[image_format]};base64,{img_str}" style="width: 100%;">''',
+                        unsafe_allow_html=True)
+        if index != slice_num:
+            column.caption(f"Last slice ({index})")
+
 def image_viewer_page():
     st.title("DESS Segmentation")
 
@@ -68,60 +109,83 @@ def image_viewer_page():
 
     selected_id = st.session_state.selected_id
 
+    layout = st.sidebar.radio("Layout", ["Single visit", "All visits"], horizontal=True)
+    if layout == "All visits":
+        visit_comparison(selected_id)
+        return
+
     # Time point selection
     time_points = ['00m', '12m', '24m', '48m', '72m']
     selected_time_point = st.selectbox("Select Time Point", time_points)
+    prefetch_neighbours(st.session_state.data_path, selected_id, st.session_state.get('id_order'), selected_time_point)
 
-    # Load image
-    image_path = os.path.join(st.session_state.data_path, 'IMAGE', selected_time_point, f"DESS_{selected_time_point}", f"{selected_id}_*_SAG_3D_DESS_LEFT_0000.nii.gz")
-    matching_files = [f for f in os.listdir(os.path.dirname(image_path)) if f.startswith(f"{selected_id}_") and f.endswith("_SAG_3D_DESS_LEFT_0000.nii.gz")]
-    
-    # Load mask
-    mask_path = os.path.join(st.session_state.data_path, 'DATA', 'pred', f"pred_{selected_time_point.lower()}_PP", f"{selected_id}_*_SAG_3D_DESS_LEFT.nii.gz")
-    matching_mask_files = [f for f in os.listdir(os.path.dirname(mask_path)) if f.startswith(f"{selected_id}_") and f.endswith("_SAG_3D_DESS_LEFT.nii.gz")]
+    # Look up image and mask in the cohort index
+    image_path = lookup(st.session_state.data_path, selected_id, selected_time_point, 'dess')
+    mask_path = lookup(st.session_state.data_path, selected_id, selected_time_point, 'pred')
     
-    if matching_files and matching_mask_files:
-        image_path = os.path.join(os.path.dirname(image_path), matching_files[0])
-        mask_path = os.path.join(os.path.dirname(mask_path), matching_mask_files[0])
-        
-        image_np, spacing = load_nifti_file(image_path)
-        image_np = normalize_mri(image_np)
-        
-        mask_np, _ = load_nifti_file(mask_path)
-
-        # Add contrast adjustment controls
-        st.sidebar.header("Image Adjustment")
-        window_center = st.sidebar.slider("Window Center", 0.0, 1.0, 0.5, 0.01)
-        window_width = st.sidebar.slider("Window Width", 0.0, 1.0, 0.5, 0.01)
-        
-        # Add mask toggle
-        show_mask = st.sidebar.checkbox("Show Mask", value=True)
+    if image_path and mask_path:
+        # Volumes are decompressed once into a memory-mapped cache, only the shown plane is read
+        volumes_dir = get_cache_dir(st.session_state.data_path, 'volumes')
+        with trace('open_volume'):
+            image_volume = open_volume(image_path, volumes_dir)
+            mask_volume = open_volume(mask_path, volumes_dir)
+        with trace('get_volume_stats'):
+            image_volume.update(get_volume_stats(st.session_state.data_path, image_volume))
+
+        viewer_mode = st.sidebar.radio("Viewer Mode", ["Server render", "Browser scrubbing"])
+
+        if viewer_mode == "Browser scrubbing":
+            # Windowing and the mask toggle live in the scrubber itself, a server control would resend the whole stack
+            window_center, window_width, show_mask = image_volume['window_center'], image_volume['window_width'], True
+        else:
+            # Add contrast adjustment controls, starting from the volume's auto window
+            st.sidebar.header("Image Adjustment")
+            window_center = st.sidebar.slider("Window Center", 0.0, 1.0, image_volume['window_center'], 0.01)
+            window_width = st.sidebar.slider("Window Width", 0.0, 1.0, image_volume['window_width'], 0.01)
+
+            # Add mask toggle
+            show_mask = st.sidebar.checkbox("Show Mask", value=True)
+
+            renderer = st.sidebar.radio("Renderer", ["Fast (PNG)", "Fast (WebP)", "Matplotlib"])
+            image_format = 'webp' if renderer == "Fast (WebP)" else 'png'
 
         # View selection
         st.sidebar.header("View Selection")
         view = st.sidebar.radio("Choose view", ["Sagittal", "Coronal", "Axial"])
 
-        if view == "Axial":
-            slice_num = st.sidebar.slider("Axial Slice", 0, image_np.shape[2] - 1, image_np.shape[2] // 2)
-            slice_data = image_np[:, :, slice_num]
-            mask_slice = mask_np[:, :, slice_num]
-            spacing_2d = (spacing[0], spacing[1])
-        elif view == "Coronal":
-            slice_num = st.sidebar.slider("Coronal Slice", 0, image_np.shape[1] - 1, image_np.shape[1] // 2)
-            slice_data = image_np[:, slice_num, :]
-            mask_slice = mask_np[:, slice_num, :]
-            spacing_2d = (spacing[0], spacing[2])
-        else:  # Sagittal
-            slice_num = st.sidebar.slider("Sagittal Slice", 0, image_np.shape[0] - 1, image_np.shape[0] // 2)
-            slice_data = image_np[slice_num, :, :]
-            mask_slice = mask_np[slice_num, :, :]
-            spacing_2d = (spacing[1], spacing[2])
-
-        img_str = plot_slice(slice_data, mask_slice, spacing_2d, window_center=window_center, window_width=window_width, show_mask=show_mask)
+        # Per-label extents from the segmentation statistics, used to start on the fullest slice of a structure
+        n_slices = image_volume['shape'][VIEW_AXES[view]]
+        structures = {LABEL_NAMES.get(label, f"Label {label}"): stats for label, stats in
+                      sorted(get_seg_stats(st.session_state.data_path, selected_id, selected_time_point).items())}
+        jump_to = st.sidebar.selectbox("Jump to structure", ["Middle slice"] + list(structures))
+        if jump_to == "Middle slice":
+            start_slice = n_slices // 2
+        else:
+            stats = structures[jump_to]
+            start_slice = int(stats[f"{view.lower()}_peak"])
+            st.sidebar.caption(f"{jump_to}: slices {int(stats[f'{view.lower()}_min'])}-{int(stats[f'{view.lower()}_max'])}, "
+                               f"{stats['volume_mm3'] / 1000:.2f} mL")
+
+        spacing_2d = plane_spacing(image_volume['spacing'], view)
+
+        if viewer_mode == "Browser scrubbing":
+            # The slice stack is encoded once per view, scrolling, windowing and the mask toggle then run in the browser
+            stack = build_slice_stack(image_volume, mask_volume, view, SEGMENTATION_LUT)
+            show_slice_scrubber(stack, spacing_2d[1] / spacing_2d[0], slice_num=start_slice, window_center=window_center,
+                                window_width=window_width, show_mask=show_mask)
+            return
+
+        slice_num = st.sidebar.slider(f"{view} Slice", 0, n_slices - 1, start_slice)
+        with trace('read_plane + normalize_slice'):
+            slice_data = normalize_slice(read_plane(image_volume, view, slice_num), image_volume['p1'], image_volume['p99'])
+            mask_slice = read_plane(mask_volume, view, slice_num)
+
+        img_str = plot_slice(slice_data, mask_slice, spacing_2d, window_center=window_center, window_width=window_width, show_mask=show_mask,
+                             renderer='matplotlib' if renderer == "Matplotlib" else 'fast', image_format=image_format)
 
         st.markdown(f"""
         <div style="display: flex; justify-content: center; align-items: center; height: 500px;">
-            <img id="mri-image" src="data:image/png;base64,{img_str}" style="max-width: 100%; max-height: 100%; object-fit: contain;">
+            <img id="mri-image" src="data:{IMAGE_MIME[image_format]};base64,{img_str}" style="max-width: 100%; max-height: 100%; object-fit: contain;">
         </div>
         """, unsafe_allow_html=True)
     else:
@@ -3,24 +3,24 @@ import os
 import pyvista as pv
 from stpyvista import stpyvista
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap
-import glob
+from prefetch import prefetch_neighbours
+from mesh_store import mesh_with_scalars
+from mesh_lod import RESOLUTION_OPTIONS, resolve_lod_level, to_lod
+from offscreen_render import show_offscreen_scene
+from scene_export import show_compact_scene
+from thickness_store import load_thickness
+from cohort_aggregates import COHORT_SCALARS, KL_GRADES, add_cohort_arrays, aggregate_path, load_aggregate, subject_kl_grade
+from thickness_change import CHANGE_SCALARS, add_change_arrays, change_clim, compute_change_maps, load_subject_visits
+from thickness_stats import CLIM_MODES, get_clim
+from tracing import trace, traced
 
-def load_and_process_mesh(stl_path, thickness_path):
-    mesh = pv.read(stl_path)
-    thickness_data = pd.read_csv(thickness_path, header=None, names=['thickness'])
-    mesh.point_data['thickness'] = thickness_data['thickness'].values
-    return mesh, thickness_data['thickness']
-
-def find_file_path(base_path):
-    pattern = os.path.join(base_path, "*_SAG_3D_DESS_LEFT")
-    matching_files = glob.glob(pattern)
-    if matching_files:
-        return matching_files[0]
-    else:
-        raise FileNotFoundError(f"No matching file found for pattern: {pattern}")
+@traced()
+def load_and_process_mesh(stl_path, selected_id, time_point, bone):
+    thickness = load_thickness(st.session_state.data_path, selected_id, time_point, bone)
+    mesh = mesh_with_scalars(stl_path, thickness, name='thickness')
+    return mesh, thickness
 
 def create_custom_colormap():
     n_bins = 256
@@ -39,30 +39,21 @@ def stl_viewer_page():
     # Time point selection
     time_points = ['00m', '12m', '24m', '48m', '72m']
     selected_time_point = st.selectbox("Select Time Point", time_points)
-    # Calculate separate vmin and vmax for tibia and femur across all time points
-    thickness_data = {'femur': [], 'tibia': []}
-    for time_point in time_points:
-        base_folder = os.path.join(st.session_state.data_path, 
-                                  'DATA/processed_PP', 
-                                  time_point)
-        try:
-            full_path = find_file_path(base_folder)
-            print(full_path)
-            for bone in ['femur', 'tibia']:
-                print(os.path.join(full_path, os.path.basename(full_path) + '_' + bone + '_cartThickness.txt'))
-                _, thickness = load_and_process_mesh(
-                    os.path.join(st.session_state.data_path, 'DATA', bone + '_ref_final.stl'),
-                    os.path.join(full_path, os.path.basename(full_path) + '_' + bone + '_cartThickness.txt')
-                )
-                thickness_data[bone].append(thickness)
-        except FileNotFoundError:
-            st.warning(f"No data found for ID {selected_id} at time point {time_point}")
-
-    vmin_vmax = {}
-    for bone in ['femur', 'tibia']:
-       
-        all_thickness = np.concatenate(thickness_data[bone])
-        vmin_vmax[bone] = (np.nanmin(all_thickness), np.nanmax(all_thickness))
+    prefetch_neighbours(st.session_state.data_path, selected_id, st.session_state.get('id_order'), selected_time_point)
+    scalar_options = dict(CHANGE_SCALARS, **COHORT_SCALARS)
+    scalar_label = st.selectbox("Scalar", list(scalar_options))
+    scalar = scalar_options[scalar_label]
+    kl_grade = None
+    if scalar in COHORT_SCALARS.values():
+        subject_grade = subject_kl_grade(st.session_state.data_path, selected_id, selected_time_point)
+        kl_grade = st.selectbox("KL Stratum", KL_GRADES, index=KL_GRADES.index(subject_grade) if subject_grade in KL_GRADES else 0,
+                                format_func=lambda grade: f"KL-{grade}" + (" (this knee)" if grade == subject_grade else ""))
+    clim_mode = st.selectbox("Colour Limits", list(CLIM_MODES))
+    resolution = st.sidebar.selectbox("Mesh Resolution", RESOLUTION_OPTIONS)
+    lod_level = resolve_lod_level(resolution, n_views=2)
+    scene_renderer = st.sidebar.radio("3D Renderer", ["stpyvista (VTK.js)", "Compact WebGL", "Server render (off-screen)"])
+    # Separate vmin and vmax for tibia and femur across all time points, from the cached per-visit stats
+    vmin_vmax = {bone: get_clim(st.session_state.data_path, selected_id, bone, clim_mode) for bone in ['femur', 'tibia']}
 
     # Create separate plots for femur and tibia
     for bone in ['femur', 'tibia']:
@@ -71,24 +62,63 @@ def stl_viewer_page():
         # Create custom colormap
         thickness_cmap = create_custom_colormap()
 
-        base_folder = os.path.join(st.session_state.data_path, 
-                                  'DATA/processed_PP', 
-                                  selected_time_point)
         try:
-            full_path = find_file_path(base_folder)
-            mesh, _ = load_and_process_mesh(
-                os.path.join(st.session_state.data_path, 'DATA', bone + '_ref_final.stl'),
-                os.path.join(full_path, os.path.basename(full_path) + '_' + bone + '_cartThickness.txt')
-            )
+            stl_path = os.path.join(st.session_state.data_path, 'DATA', bone + '_ref_final.stl')
+            if scalar in COHORT_SCALARS.values() and not os.path.exists(
+                    aggregate_path(st.session_state.data_path, bone, selected_time_point, kl_grade)):
+                st.error(f"No KL-{kl_grade} aggregate for {bone} at {selected_time_point}, run cohort_aggregates.py first")
+                continue
+
+            def prepare_mesh():
+                # Visit loading, change maps and the LOD projection; pooled off-screen scenes skip all of it
+                mesh, _ = load_and_process_mesh(stl_path, selected_id, selected_time_point, bone)
+                cmap, clim = thickness_cmap, vmin_vmax[bone]
+                if scalar in ('delta', 'slope', 'loss'):
+                    # Longitudinal maps are computed over all visits on the shared reference topology
+                    maps = compute_change_maps(load_subject_visits(st.session_state.data_path, selected_id, bone))
+                    add_change_arrays(mesh, maps, time_points.index(selected_time_point))
+                    cmap = ['lightgrey', 'red'] if scalar == 'loss' else 'RdBu'
+                    clim = change_clim(maps, scalar)
+                elif scalar in COHORT_SCALARS.values():
+                    # Persisted per-vertex aggregates, no rescan of the cohort
+                    aggregate = load_aggregate(st.session_state.data_path, bone, selected_time_point, kl_grade)
+                    add_cohort_arrays(mesh, mesh.point_data['thickness'], aggregate)
+                    if scalar == 'zscore':
+                        cmap, clim = 'RdBu', (-3, 3)
+                return to_lod(mesh, stl_path, lod_level), cmap, clim
+
+            if scene_renderer == "Compact WebGL":
+                # Quantised geometry cached once per level, only the uint8 scalar layer is per visit
+                mesh, cmap, clim = prepare_mesh()
+                values = mesh.point_data[scalar]
+                if clim is None:
+                    clim = (np.nanmin(values), np.nanmax(values))
+                payload = show_compact_scene(mesh, stl_path, {selected_time_point: values}, clim, cmap,
+                                             level=lod_level, title=f"{bone.capitalize()} - {scalar_label}")
+                st.caption(f"Scene payload: {payload / 1024:.0f} kB")
+                continue
 
             # Thickness plot
-            plotter_thickness = pv.Plotter()
-            plotter_thickness.background_color = 'black'
-            plotter_thickness.add_mesh(mesh, scalars='thickness', cmap=thickness_cmap, clim=vmin_vmax[bone],
-                                       show_scalar_bar=True, nan_color='grey')
-            plotter_thickness.add_text(f"{selected_time_point} - Thickness", position='upper_left', font_size=10, color='white')
-            plotter_thickness.view_isometric()
-            stpyvista(plotter_thickness, key=f"stl_viewer_thickness_{bone}_{selected_time_point}")
+            def build_scene(plotter):
+                mesh, cmap, clim = prepare_mesh()
+                plotter.background_color = 'black'
+                plotter.add_mesh(mesh, scalars=scalar, cmap=cmap, clim=clim,
+                                 show_scalar_bar=True, nan_color='grey')
+                plotter.add_text(f"{selected_time_point} - {scalar_label}", position='upper_left', font_size=10, color='white')
+                plotter.view_isometric()
+
+            if scene_renderer == "Server render (off-screen)":
+                # The scene stays in this session's off-screen plotter pool, camera moves only send a JPEG frame
+                with trace('offscreen render'):
+                    show_offscreen_scene(f"thickness_{selected_id}_{bone}_{selected_time_point}_{scalar}_{kl_grade}_{lod_level}_{clim_mode}",
+                                         build_scene, controls_key=f"offscreen_{bone}")
+                continue
+
+            with trace('plotter'):
+                plotter_thickness = pv.Plotter()
+                build_scene(plotter_thickness)
+            with trace('stpyvista'):
+                stpyvista(plotter_thickness, key=f"stl_viewer_thickness_{bone}_{selected_time_point}_{scalar}_{kl_grade}_{lod_level}")
 
         except FileNotFoundError:
             st.error(f"No data found for ID {selected_id} at time point {selected_time_point}")
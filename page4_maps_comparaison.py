@@ -3,24 +3,37 @@ import os
 import pyvista as pv
 from stpyvista import stpyvista
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap
-import glob
-
-def load_and_process_mesh(stl_path, thickness_path):
-    mesh = pv.read(stl_path)
-    thickness_data = pd.read_csv(thickness_path, header=None, names=['thickness'])
-    mesh.point_data['thickness'] = thickness_data['thickness'].values
-    return mesh, thickness_data['thickness']
-
-def find_file_path(base_path):
-    pattern = f"{base_path}*_SAG_3D_DESS_LEFT"
-    matching_files = glob.glob(pattern)
-    if matching_files:
-        return matching_files[0]
-    else:
-        raise FileNotFoundError(f"No matching file found for pattern: {pattern}")
+from mesh_store import mesh_with_scalars
+from mesh_lod import RESOLUTION_OPTIONS, resolve_lod_level, to_lod
+from offscreen_render import show_offscreen_scene
+from scene_export import show_compact_scene
+from thickness_store import load_thickness
+from thickness_stats import CLIM_MODES, get_clim
+from tracing import trace, traced
+
+@traced()
+def load_and_process_mesh(stl_path, selected_id, time_point, bone):
+    thickness = load_thickness(st.session_state.data_path, selected_id, time_point, bone)
+    mesh = mesh_with_scalars(stl_path, thickness, name='thickness')
+    return mesh, thickness
+
+def load_time_series_mesh(stl_path, selected_id, time_points, bone):
+    # A single shallow copy of the reference carries every visit as its own point array
+    mesh = None
+    available = []
+    for time_point in time_points:
+        try:
+            thickness = load_thickness(st.session_state.data_path, selected_id, time_point, bone)
+        except FileNotFoundError:
+            continue
+        if mesh is None:
+            mesh = mesh_with_scalars(stl_path, thickness, name=f"thickness_{time_point}")
+        else:
+            mesh.point_data[f"thickness_{time_point}"] = thickness
+        available.append(time_point)
+    return mesh, available
 
 def create_custom_colormap():
     n_bins = 256
@@ -40,64 +53,124 @@ def comp_viewer_page():
     # Time points
     time_points = ['00m', '12m', '24m', '48m', '72m']
 
-    # Calculate separate vmin and vmax for tibia and femur across all time points
-    thickness_data = {'femur': [], 'tibia': []}
-
-    for time_point in time_points:
-        base_path = os.path.join(st.session_state.data_path, 'DATA/processed_PP', time_point, f"{selected_id}_")
-        try:
-            full_path = find_file_path(base_path)
-            for bone in ['femur', 'tibia']:
-                _, thickness = load_and_process_mesh(
-                    os.path.join(st.session_state.data_path, 'DATA', bone + '_ref_final.stl'),
-                    os.path.join(full_path, os.path.basename(full_path) + '_' + bone + '_cartThickness.txt')
-                )
-                thickness_data[bone].append(thickness)
-        except FileNotFoundError:
-            st.warning(f"No data found for ID {selected_id} at time point {time_point}")
-
-    vmin_vmax = {}
-    for bone in ['femur', 'tibia']:
-        all_thickness = np.concatenate(thickness_data[bone])
-        vmin_vmax[bone] = (np.nanmin(all_thickness), np.nanmax(all_thickness))
+    clim_mode = st.selectbox("Colour Limits", list(CLIM_MODES))
+    # Separate vmin and vmax for tibia and femur across all time points, from the cached per-visit stats
+    vmin_vmax = {bone: get_clim(st.session_state.data_path, selected_id, bone, clim_mode) for bone in ['femur', 'tibia']}
 
     # Create custom colormap
     thickness_cmap = create_custom_colormap()
 
+    layout = st.radio("Layout", ["Grid (one mesh per time point)", "Shared geometry (time slider)"], horizontal=True)
+    resolution = st.sidebar.selectbox("Mesh Resolution", RESOLUTION_OPTIONS)
+    # The grid shows five views per bone, the shared geometry layout one
+    lod_level = resolve_lod_level(resolution, n_views=2 * len(time_points) if layout.startswith("Grid") else 2)
+    renderer_options = ["stpyvista (VTK.js)", "Server render (off-screen)"]
+    if layout == "Shared geometry (time slider)":
+        renderer_options.append("Compact WebGL")
+    scene_renderer = st.sidebar.radio("3D Renderer", renderer_options)
+
+    if layout == "Shared geometry (time slider)":
+        # The geometry is sent once per bone, only the active visit array changes
+        if scene_renderer != "Compact WebGL":
+            shown_time_point = st.select_slider("Time Point", options=time_points)
+        for bone in ['femur', 'tibia']:
+            st.subheader(f"{bone.capitalize()} Visualization")
+            stl_path = os.path.join(st.session_state.data_path, 'DATA', bone + '_ref_final.stl')
+            mesh, available = load_time_series_mesh(stl_path, selected_id, time_points, bone)
+            if not available:
+                st.error(f"No data found for ID {selected_id}")
+                continue
+            mesh = to_lod(mesh, stl_path, lod_level)
+
+            if scene_renderer == "Compact WebGL":
+                # All visits travel as uint8 layers over one quantised geometry, switching happens in the browser
+                layers = {time_point: mesh.point_data[f"thickness_{time_point}"] for time_point in available}
+                clim = vmin_vmax[bone] or (min(np.nanmin(v) for v in layers.values()), max(np.nanmax(v) for v in layers.values()))
+                payload = show_compact_scene(mesh, stl_path, layers, clim, thickness_cmap, level=lod_level,
+                                             title=f"{bone.capitalize()} - Thickness")
+                st.caption(f"Scene payload: {payload / 1024:.0f} kB")
+                continue
+
+            if shown_time_point not in available:
+                st.error(f"No data found for ID {selected_id} at time point {shown_time_point}")
+                continue
+
+            def build_scene(plotter):
+                plotter.background_color = 'black'
+                plotter.add_mesh(mesh, scalars=f"thickness_{shown_time_point}", cmap=thickness_cmap, clim=vmin_vmax[bone],
+                                 show_scalar_bar=True, nan_color='grey')
+                plotter.add_text(f"{shown_time_point} - Thickness", position='upper_left', font_size=10, color='white')
+                plotter.view_isometric()
+
+            if scene_renderer == "Server render (off-screen)":
+                with trace('offscreen render'):
+                    show_offscreen_scene(f"series_{selected_id}_{bone}_{shown_time_point}_{lod_level}_{clim_mode}",
+                                         build_scene, controls_key=f"offscreen_series_{bone}")
+                continue
+
+            with trace('plotter'):
+                plotter = pv.Plotter()
+                build_scene(plotter)
+            with trace('stpyvista'):
+                stpyvista(plotter, key=f"stl_viewer_series_{bone}_{shown_time_point}_{lod_level}")
+        return
+
     # Create a 3x2 grid for femur and tibia
     for bone in ['femur', 'tibia']:
         st.subheader(f"{bone.capitalize()} Visualization")
-        
+
+        stl_path = os.path.join(st.session_state.data_path, 'DATA', bone + '_ref_final.stl')
+        # Visits missing from a grid, kept per scene since pooled off-screen scenes skip the loading below
+        missing = st.session_state.setdefault('grid_missing', {})
+        scene_key = f"grid_{selected_id}_{bone}_{lod_level}_{clim_mode}"
+
         # Create a 3x2 grid with black background
-        grid = pv.Plotter(shape=(3, 2))
-        grid.background_color = 'black'
-        for i, time_point in enumerate(time_points):
-            base_path = os.path.join(st.session_state.data_path, 'DATA/processed_PP', time_point, f"{selected_id}_")
-            try:
-                full_path = find_file_path(base_path)
-                mesh, _ = load_and_process_mesh(
-                   os.path.join(st.session_state.data_path, 'DATA', bone + '_ref_final.stl'),
-                    os.path.join(full_path, os.path.basename(full_path) + '_' + bone + '_cartThickness.txt')
-                )
-    
+        def build_grid(grid):
+            meshes = {}
+            for time_point in time_points:
+                try:
+                    mesh, _ = load_and_process_mesh(stl_path, selected_id, time_point, bone)
+                    meshes[time_point] = to_lod(mesh, stl_path, lod_level)
+                except FileNotFoundError:
+                    continue
+            missing[scene_key] = [time_point for time_point in time_points if time_point not in meshes]
+
+            grid.background_color = 'black'
+            for i, time_point in enumerate(time_points):
+                if time_point not in meshes:
+                    continue
                 # Thickness plot
                 row = i // 2
                 col = i % 2
 
                 grid.subplot(row, col)
-                grid.add_mesh(mesh, scalars='thickness', cmap=thickness_cmap, clim=vmin_vmax[bone],
+                grid.add_mesh(meshes[time_point], scalars='thickness', cmap=thickness_cmap, clim=vmin_vmax[bone],
                               show_scalar_bar=True, nan_color='grey')
                 grid.add_text(f"{time_point} - Thickness", position='upper_left', font_size=10, color='white')
                 grid.view_isometric()
-    
-            except FileNotFoundError:
+            # Link the cameras across all subplots
+            grid.link_views()
+
+        def show_missing():
+            for time_point in missing.get(scene_key, []):
                 st.error(f"No data found for ID {selected_id} at time point {time_point}")
-                continue
-        # Link the cameras across all subplots
-        grid.link_views()
-    
+
+        if scene_renderer == "Server render (off-screen)":
+            # Ten meshes stay on the server, the browser only receives one frame per camera move
+            with trace('offscreen render'):
+                show_offscreen_scene(scene_key, build_grid, shape=(3, 2),
+                                     window_size=[800, 1000], controls_key=f"offscreen_grid_{bone}")
+            show_missing()
+            continue
+
+        with trace('plotter'):
+            grid = pv.Plotter(shape=(3, 2))
+            build_grid(grid)
+        show_missing()
+
         # Display the grid
-        stpyvista(grid, key=f"stl_viewer_grid_{bone}")
+        with trace('stpyvista'):
+            stpyvista(grid, key=f"stl_viewer_grid_{bone}_{lod_level}")
 
 if __name__ == "__main__":
     comp_viewer_page()
@@ -0,0 +1,38 @@
+import streamlit as st
+import os
+from atlas_store import PROGRESS_FILENAME, atlas_dir, read_progress
+
+def qc_atlas_page():
+    st.title("QC Atlas")
+
+    done = read_progress(st.session_state.data_path)
+    if not done:
+        st.warning(f"No atlas found. Render it with: python batch_render.py {st.session_state.data_path}")
+        return
+
+    time_points = ['00m', '12m', '24m', '48m', '72m']
+    selected_time_point = st.selectbox("Select Time Point", time_points)
+    records = [record for (_, time_point), record in sorted(done.items())
+               if time_point == selected_time_point and record['status'] == 'done']
+    errors = sum(record['status'] == 'error' for record in done.values())
+    st.caption(f"{len(records)} visits rendered at {selected_time_point}, {errors} failed "
+               f"(see {os.path.join(atlas_dir(st.session_state.data_path), PROGRESS_FILENAME)})")
+
+    page_size = st.sidebar.selectbox("Subjects per page", [5, 10, 20], index=1)
+    n_pages = max(1, (len(records) + page_size - 1) // page_size)
+    page = st.sidebar.number_input("Page", 1, n_pages, 1)
+
+    for record in records[(page - 1) * page_size:page * page_size]:
+        columns = st.columns([1, 3, 3, 3])
+        columns[0].markdown(f"**{record['id']}**")
+        if columns[0].button("Open", key=f"atlas_open_{record['id']}"):
+            st.session_state.selected_id = record['id']
+            st.success(f"ID {record['id']} selected.")
+        for column, name in zip(columns[1:], ['slice', 'femur', 'tibia']):
+            if name in record['outputs'] and os.path.exists(record['outputs'][name]):
+                column.image(record['outputs'][name], use_container_width=True)
+            else:
+                column.caption(f"No {name} snapshot")
+
+if __name__ == '__main__':
+    qc_atlas_page()
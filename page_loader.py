@@ -0,0 +1,77 @@
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Menu entry -> (module, page function); modules are only imported when their page is first shown
+PAGES = {
+    "ID Selection": ('page1_id_selection', 'id_selection_page'),
+    "DESS Segmentation": ('page2_image_viewer', 'image_viewer_page'),
+    "Model Viewer": ('page3_stl_viewer', 'stl_viewer_page'),
+    "Comparaison of maps": ('page4_maps_comparaison', 'comp_viewer_page'),
+    "QC Atlas": ('page5_qc_atlas', 'qc_atlas_page'),
+}
+WARMUP = os.environ.get('OAI_WARMUP', '1') != '0'
+
+_lock = threading.Lock()
+_report = {}
+_warmup = {'thread': None, 'seconds': None}
+
+def _timed_import(module_name, source):
+    # import_module waits for a module that another thread is still initialising, so this is safe against the warm-up
+    already_loaded = module_name in sys.modules
+    n_modules = len(sys.modules)
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if not already_loaded:
+        with _lock:
+            _report.setdefault(module_name, {'seconds': time.perf_counter() - start,
+                                             'new_modules': len(sys.modules) - n_modules, 'source': source})
+    return module
+
+def load_page(name):
+    module_name, function_name = PAGES[name]
+    return getattr(_timed_import(module_name, 'selection'), function_name)
+
+def _warm(module_names):
+    start = time.perf_counter()
+    for module_name in module_names:
+        try:
+            _timed_import(module_name, 'warm-up')
+        except Exception as e:
+            with _lock:
+                _report[module_name] = {'error': repr(e), 'source': 'warm-up'}
+    _warmup['seconds'] = time.perf_counter() - start
+
+def start_warmup():
+    # Called at the end of a script run, so the first page is already on screen; runs once per process
+    with _lock:
+        if not WARMUP or _warmup['thread'] is not None:
+            return
+        thread = threading.Thread(target=_warm, args=([module for module, _ in PAGES.values()],),
+                                  name='oai-warmup', daemon=True)
+        _warmup['thread'] = thread
+    thread.start()
+
+def import_report():
+    with _lock:
+        thread = _warmup['thread']
+        status = 'disabled' if not WARMUP else 'not started' if thread is None else \
+            'running' if thread.is_alive() else f"done in {_warmup['seconds']:.1f} s"
+        return {module: dict(entry) for module, entry in _report.items()}, status
+
+def measure_cold_imports(python=sys.executable):
+    # Each page imported in a fresh interpreter, which is what a worker restart pays
+    timings = {}
+    for name, (module_name, _) in PAGES.items():
+        code = f"import time; start = time.perf_counter(); import {module_name}; print(time.perf_counter() - start)"
+        result = subprocess.run([python, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True)
+        timings[name] = float(result.stdout.strip()) if result.returncode == 0 else result.stderr.strip().splitlines()[-1]
+    return timings
+
+if __name__ == '__main__':
+    for name, seconds in measure_cold_imports().items():
+        print(f"{name:22s} {seconds:7.2f} s" if isinstance(seconds, float) else f"{name:22s} {seconds}")
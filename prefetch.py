@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import nibabel as nib
+import numpy as np
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from cohort_index import TIME_POINTS, BONES, get_cache_dir, lookup
+from mesh_store import get_reference_mesh
+from thickness_stats import get_thickness_stats
+from volume_access import VOLUME_CACHE_BYTES, is_volume_cached, open_volume, volume_cache_bytes
+from volume_stats import get_volume_stats
+
+MAX_WORKERS = int(os.environ.get('OAI_PREFETCH_WORKERS', 2))
+# Bytes a single selection may decompress into the volume cache before the rest of its queue is dropped
+MEMORY_BUDGET = int(os.environ.get('OAI_PREFETCH_BUDGET', 2 * 1024 ** 3))
+N_NEXT = 3
+# Idle sessions whose tasks have all finished are dropped after this many seconds
+SESSION_TTL = 3600
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='oai-prefetch')
+_lock = threading.Lock()
+# One prefetch state per browser session, so one reviewer's selection never cancels another's warm-up
+_sessions = {}
+
+def _session_id():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+def _prune_sessions(now):
+    for session_id, state in list(_sessions.items()):
+        if now - state['updated'] > SESSION_TTL and all(future.done() for future in state['futures']):
+            del _sessions[session_id]
+
+def _is_current(state, generation):
+    return state['generation'] == generation
+
+def _charge(state, generation, n_bytes):
+    with _lock:
+        if not _is_current(state, generation) or state['used'] + n_bytes > MEMORY_BUDGET:
+            return False
+        state['used'] += n_bytes
+        return True
+
+def _decoded_bytes(path):
+    # From the NIfTI header only, so the budget is checked before anything is decompressed
+    header = nib.load(path).header
+    return int(np.prod(header.get_data_shape())) * header.get_data_dtype().itemsize
+
+def _warm_subject(data_path, subject_id, state, generation):
+    if not _is_current(state, generation):
+        return
+    for bone in BONES:
+        get_reference_mesh(os.path.join(data_path, 'DATA', bone + '_ref_final.stl'))
+    get_thickness_stats(data_path, subject_id)
+
+def _warm_visit(data_path, subject_id, time_point, state, generation):
+    volumes_dir = get_cache_dir(data_path, 'volumes')
+    for kind in ['dess', 'pred']:
+        if not _is_current(state, generation):
+            return
+        path = lookup(data_path, subject_id, time_point, kind)
+        if path is None:
+            continue
+        # Volumes already in the disk cache are only memory-mapped and cost nothing against the budget
+        if not is_volume_cached(path, volumes_dir):
+            n_bytes = _decoded_bytes(path)
+            # Prefetching stops short of the disk cache cap rather than making it evict volumes that were viewed
+            if volume_cache_bytes(volumes_dir) + n_bytes > VOLUME_CACHE_BYTES or not _charge(state, generation, n_bytes):
+                return
+        volume = open_volume(path, volumes_dir)
+        if kind == 'dess':
+            get_volume_stats(data_path, volume)
+
+def _cancel(state):
+    state['generation'] += 1
+    state['selection'] = None
+    for future in state['futures']:
+        future.cancel()
+    state['futures'] = []
+    state['used'] = 0
+
+def prefetch_neighbours(data_path, subject_id, id_order=None, current_time_point=None, n_next=N_NEXT):
+    selection = (data_path, subject_id)
+    session_id = _session_id()
+    state = _sessions.get(session_id)
+    if state is not None and state['selection'] == selection:
+        return
+
+    # Other visits of the selected subject first, then the next subjects in table order
+    tasks = [(subject_id, time_point) for time_point in TIME_POINTS if time_point != current_time_point]
+    next_ids = []
+    if id_order is not None and subject_id in id_order:
+        position = list(id_order).index(subject_id)
+        next_ids = list(id_order)[position + 1:position + 1 + n_next]
+    for next_id in next_ids:
+        tasks.extend((next_id, time_point) for time_point in TIME_POINTS)
+
+    with _lock:
+        now = time.monotonic()
+        _prune_sessions(now)
+        state = _sessions.setdefault(session_id, {'generation': 0, 'selection': None, 'futures': [], 'used': 0})
+        _cancel(state)
+        generation = state['generation']
+        state['selection'] = selection
+        state['updated'] = now
+        futures = [_executor.submit(_warm_subject, data_path, sid, state, generation) for sid in [subject_id] + next_ids]
+        futures += [_executor.submit(_warm_visit, data_path, sid, time_point, state, generation) for sid, time_point in tasks]
+        state['futures'] = futures
@@ -0,0 +1,269 @@
+import base64
+import json
+import os
+import zlib
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import ListedColormap
+import streamlit.components.v1 as components
+from memory_cache import file_key, get_or_load
+
+NAN_COLOR = (128, 128, 128)
+
+def _pack(array):
+    return base64.b64encode(zlib.compress(np.ascontiguousarray(array).tobytes(), 6)).decode("ascii")
+
+def encode_geometry(mesh):
+    # Positions quantised to uint16 over the bounding box, indices delta + zigzag coded before deflate
+    points = np.asarray(mesh.points, dtype=np.float64)
+    bbox_min = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - bbox_min, 1e-9)
+    positions = np.round((points - bbox_min) / extent * 65535).astype(np.uint16)
+
+    faces = mesh.triangulate().faces.reshape(-1, 4)[:, 1:]
+    deltas = np.diff(faces.ravel().astype(np.int64), prepend=0)
+    zigzag = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint32)
+    return {
+        'n_points': int(len(points)),
+        'n_triangles': int(len(faces)),
+        'bbox_min': bbox_min.tolist(),
+        'extent': extent.tolist(),
+        'positions': _pack(positions),
+        'indices': _pack(zigzag),
+    }
+
+def get_geometry(mesh, stl_path, level='Full'):
+    # Written once per reference mesh and level, then reused by every scene
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(stl_path)), 'cache', 'scenes')
+    key = ('scene', level) + file_key('stl', stl_path)
+
+    def load():
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, f"{os.path.basename(stl_path)}.{key[-2]}.{level.rstrip('%')}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        geometry = encode_geometry(mesh)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(geometry, f)
+        os.replace(path + '.tmp', path)
+        return geometry
+
+    return get_or_load(key, load)
+
+def colormap_lut(cmap):
+    if isinstance(cmap, (list, tuple)):
+        cmap = ListedColormap(cmap)
+    lut = np.round(plt.get_cmap(cmap)(np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+    # Index 0 is reserved for NaN
+    lut[0] = NAN_COLOR
+    return lut
+
+def encode_scalars(values, clim, encoding='uint8'):
+    values = np.asarray(values, dtype=np.float32)
+    if encoding == 'float16':
+        return _pack(values.astype(np.float16))
+    vmin, vmax = clim
+    scaled = np.clip((values - vmin) / max(vmax - vmin, 1e-9), 0, 1) * 254 + 1
+    return _pack(np.where(np.isnan(values), 0, np.round(scaled)).astype(np.uint8))
+
+def payload_size(geometry, layers):
+    return len(geometry['positions']) + len(geometry['indices']) + sum(len(layer) for layer in layers.values())
+
+def compact_scene_html(geometry, layers, clim, lut, encoding='uint8', title='', height=450):
+    config = {
+        'geometry': geometry, 'layers': layers, 'clim': list(map(float, clim)), 'encoding': encoding,
+        'lut': base64.b64encode(lut.tobytes()).decode("ascii"), 'title': title,
+    }
+    return f"""
+    <div style="background: black; color: white; font-family: sans-serif; font-size: 12px; position: relative;">
+        <canvas id="scene" style="width: 100%; height: {height - 40}px; display: block;"></canvas>
+        <div style="position: absolute; top: 6px; left: 8px;" id="title"></div>
+        <div style="display: flex; gap: 8px; align-items: center; padding: 6px;" id="controls">
+            <span id="vmin"></span><canvas id="legend" width="200" height="10"></canvas><span id="vmax"></span>
+        </div>
+    </div>
+    <script>
+    const cfg = {json.dumps(config)};
+
+    async function inflate(b64) {{
+        const bytes = Uint8Array.from(atob(b64), c => c.charCodeAt(0));
+        const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+        return new Uint8Array(await new Response(stream).arrayBuffer());
+    }}
+
+    function halfToFloat(h) {{
+        const s = (h & 0x8000) ? -1 : 1, e = (h >> 10) & 0x1f, f = h & 0x3ff;
+        if (e === 0) return s * Math.pow(2, -14) * (f / 1024);
+        if (e === 31) return f ? NaN : s * Infinity;
+        return s * Math.pow(2, e - 15) * (1 + f / 1024);
+    }}
+
+    function perspective(fovy, aspect, near, far) {{
+        const f = 1 / Math.tan(fovy / 2), nf = 1 / (near - far);
+        return [f / aspect, 0, 0, 0, 0, f, 0, 0, 0, 0, (far + near) * nf, -1, 0, 0, 2 * far * near * nf, 0];
+    }}
+
+    function modelView(yaw, pitch, distance) {{
+        const cy = Math.cos(yaw), sy = Math.sin(yaw), cp = Math.cos(pitch), sp = Math.sin(pitch);
+        return [cy, sp * sy, -cp * sy, 0, 0, cp, sp, 0, sy, -sp * cy, cp * cy, 0, 0, 0, -distance, 1];
+    }}
+
+    async function main() {{
+        const g = cfg.geometry;
+        const q = new Uint16Array((await inflate(g.positions)).buffer);
+        const zigzag = new Uint32Array((await inflate(g.indices)).buffer);
+        const indices = new Uint32Array(zigzag.length);
+        let previous = 0;
+        for (let i = 0; i < zigzag.length; i++) {{
+            const z = zigzag[i];
+            previous += (z >>> 1) ^ -(z & 1);
+            indices[i] = previous;
+        }}
+
+        // Dequantise into a unit-sized box centred on the origin
+        const scale = Math.max(...g.extent);
+        const positions = new Float32Array(q.length);
+        for (let i = 0; i < q.length; i++) {{
+            const axis = i % 3;
+            positions[i] = ((q[i] / 65535 - 0.5) * g.extent[axis]) / scale;
+        }}
+        const normals = new Float32Array(positions.length);
+        for (let t = 0; t < indices.length; t += 3) {{
+            const a = indices[t] * 3, b = indices[t + 1] * 3, c = indices[t + 2] * 3;
+            const ux = positions[b] - positions[a], uy = positions[b + 1] - positions[a + 1], uz = positions[b + 2] - positions[a + 2];
+            const vx = positions[c] - positions[a], vy = positions[c + 1] - positions[a + 1], vz = positions[c + 2] - positions[a + 2];
+            const nx = uy * vz - uz * vy, ny = uz * vx - ux * vz, nz = ux * vy - uy * vx;
+            for (const v of [a, b, c]) {{ normals[v] += nx; normals[v + 1] += ny; normals[v + 2] += nz; }}
+        }}
+
+        const lut = Uint8Array.from(atob(cfg.lut), c => c.charCodeAt(0));
+        const layers = {{}};
+        for (const [name, b64] of Object.entries(cfg.layers)) {{
+            const raw = await inflate(b64);
+            if (cfg.encoding === 'float16') {{
+                const half = new Uint16Array(raw.buffer);
+                const index = new Uint8Array(half.length);
+                const [vmin, vmax] = cfg.clim;
+                for (let i = 0; i < half.length; i++) {{
+                    const v = halfToFloat(half[i]);
+                    index[i] = isNaN(v) ? 0 : 1 + Math.round(Math.min(Math.max((v - vmin) / (vmax - vmin), 0), 1) * 254);
+                }}
+                layers[name] = index;
+            }} else {{
+                layers[name] = raw;
+            }}
+        }}
+
+        const canvas = document.getElementById('scene');
+        canvas.width = canvas.clientWidth * devicePixelRatio;
+        canvas.height = canvas.clientHeight * devicePixelRatio;
+        const gl = canvas.getContext('webgl2');
+        const program = gl.createProgram();
+        for (const [type, source] of [[gl.VERTEX_SHADER, `#version 300 es
+            in vec3 position; in vec3 normal; in vec3 color;
+            uniform mat4 projection, view;
+            out vec3 vColor; out vec3 vNormal;
+            void main() {{
+                vColor = color;
+                vNormal = mat3(view) * normal;
+                gl_Position = projection * view * vec4(position, 1.0);
+            }}`], [gl.FRAGMENT_SHADER, `#version 300 es
+            precision mediump float;
+            in vec3 vColor; in vec3 vNormal; out vec4 outColor;
+            void main() {{
+                float light = 0.3 + 0.7 * abs(normalize(vNormal).z);
+                outColor = vec4(vColor * light, 1.0);
+            }}`]]) {{
+            const shader = gl.createShader(type);
+            gl.shaderSource(shader, source);
+            gl.compileShader(shader);
+            gl.attachShader(program, shader);
+        }}
+        gl.linkProgram(program);
+        gl.useProgram(program);
+
+        function attribute(name, data, size, type, normalized) {{
+            const buffer = gl.createBuffer();
+            gl.bindBuffer(gl.ARRAY_BUFFER, buffer);
+            gl.bufferData(gl.ARRAY_BUFFER, data, gl.STATIC_DRAW);
+            const location = gl.getAttribLocation(program, name);
+            gl.enableVertexAttribArray(location);
+            gl.vertexAttribPointer(location, size, type, normalized, 0, 0);
+            return buffer;
+        }}
+        attribute('position', positions, 3, gl.FLOAT, false);
+        attribute('normal', normals, 3, gl.FLOAT, false);
+        const colors = new Uint8Array(g.n_points * 3);
+        const colorBuffer = attribute('color', colors, 3, gl.UNSIGNED_BYTE, true);
+        gl.bindBuffer(gl.ELEMENT_ARRAY_BUFFER, gl.createBuffer());
+        gl.bufferData(gl.ELEMENT_ARRAY_BUFFER, indices, gl.STATIC_DRAW);
+        gl.enable(gl.DEPTH_TEST);
+
+        let yaw = 0.8, pitch = 0.5, distance = 2.2, drag = null;
+        function draw() {{
+            gl.viewport(0, 0, canvas.width, canvas.height);
+            gl.clearColor(0, 0, 0, 1);
+            gl.clear(gl.COLOR_BUFFER_BIT | gl.DEPTH_BUFFER_BIT);
+            gl.uniformMatrix4fv(gl.getUniformLocation(program, 'projection'), false, perspective(0.6, canvas.width / canvas.height, 0.1, 10));
+            gl.uniformMatrix4fv(gl.getUniformLocation(program, 'view'), false, modelView(yaw, pitch, distance));
+            gl.drawElements(gl.TRIANGLES, indices.length, gl.UNSIGNED_INT, 0);
+        }}
+        function showLayer(name) {{
+            // Switching visits only re-uploads the colour buffer, the geometry stays on the GPU
+            const index = layers[name];
+            for (let i = 0; i < index.length; i++) {{
+                colors[i * 3] = lut[index[i] * 3];
+                colors[i * 3 + 1] = lut[index[i] * 3 + 1];
+                colors[i * 3 + 2] = lut[index[i] * 3 + 2];
+            }}
+            gl.bindBuffer(gl.ARRAY_BUFFER, colorBuffer);
+            gl.bufferSubData(gl.ARRAY_BUFFER, 0, colors);
+            document.getElementById('title').textContent = cfg.title + ' ' + name;
+            draw();
+        }}
+
+        canvas.addEventListener('mousedown', e => drag = [e.clientX, e.clientY]);
+        window.addEventListener('mouseup', () => drag = null);
+        window.addEventListener('mousemove', e => {{
+            if (!drag) return;
+            yaw += (e.clientX - drag[0]) * 0.01;
+            pitch = Math.min(Math.max(pitch + (e.clientY - drag[1]) * 0.01, -1.5), 1.5);
+            drag = [e.clientX, e.clientY];
+            draw();
+        }});
+        canvas.addEventListener('wheel', e => {{
+            e.preventDefault();
+            distance = Math.min(Math.max(distance * (e.deltaY > 0 ? 1.1 : 0.9), 0.5), 8);
+            draw();
+        }});
+
+        const legend = document.getElementById('legend').getContext('2d');
+        for (let x = 0; x < 200; x++) {{
+            const i = 1 + Math.round(x / 199 * 254);
+            legend.fillStyle = `rgb(${{lut[i * 3]}}, ${{lut[i * 3 + 1]}}, ${{lut[i * 3 + 2]}})`;
+            legend.fillRect(x, 0, 1, 10);
+        }}
+        document.getElementById('vmin').textContent = cfg.clim[0].toFixed(2);
+        document.getElementById('vmax').textContent = cfg.clim[1].toFixed(2);
+
+        const names = Object.keys(layers);
+        if (names.length > 1) {{
+            for (const name of names) {{
+                const button = document.createElement('button');
+                button.textContent = name;
+                button.onclick = () => showLayer(name);
+                document.getElementById('controls').appendChild(button);
+            }}
+        }}
+        showLayer(names[0]);
+    }}
+    main();
+    </script>
+    """
+
+def show_compact_scene(mesh, stl_path, layers, clim, cmap, level='Full', encoding='uint8', title='', height=450):
+    geometry = get_geometry(mesh, stl_path, level)
+    encoded = {name: encode_scalars(values, clim, encoding) for name, values in layers.items()}
+    components.html(compact_scene_html(geometry, encoded, clim, colormap_lut(cmap), encoding, title, height), height=height)
+    return payload_size(geometry, encoded)
@@ -0,0 +1,151 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from cohort_index import TIME_POINTS, connect_index, get_cache_dir, list_ids, lookup
+from volume_access import VIEW_AXES, get_view_array, open_volume
+
+# Prediction mask labels (OAI-ZIB convention)
+LABEL_NAMES = {
+    1: 'Femoral bone',
+    2: 'Femoral cartilage',
+    3: 'Tibial bone',
+    4: 'Tibial cartilage',
+}
+EXTENT_COLUMNS = [f"{view.lower()}_{part}" for view in VIEW_AXES for part in ('min', 'max', 'peak')]
+STAT_COLUMNS = ['voxels', 'volume_mm3'] + EXTENT_COLUMNS
+
+def _create_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS seg_stats (
+            id INTEGER NOT NULL,
+            time_point TEXT NOT NULL,
+            label INTEGER NOT NULL,
+            source_mtime REAL NOT NULL,
+            {', '.join(f'{column} REAL' for column in STAT_COLUMNS)},
+            PRIMARY KEY (id, time_point, label)
+        )
+    """)
+
+# Marks a mask without any label, so that it is not recomputed on every view
+EMPTY_LABEL = 0
+
+def compute_seg_stats(mask, spacing):
+    # (plane, label) counts for every axis, accumulated one sagittal plane at a time so that only
+    # plane-sized index arrays are allocated; they give counts, extents and the fullest plane of every label
+    n_labels = int(mask.max()) + 1
+    voxel_mm3 = float(np.prod(spacing[:3]))
+    shape = mask.shape[:3]
+    per_axis = {view: np.zeros((shape[axis], n_labels), dtype=np.int64) for view, axis in VIEW_AXES.items()}
+    coronal_index = np.arange(shape[1])[:, None] * n_labels
+    axial_index = np.arange(shape[2])[None, :] * n_labels
+    for i in range(shape[0]):
+        plane = np.asarray(mask[i]).astype(np.intp)
+        per_axis['Sagittal'][i] = np.bincount(plane.ravel(), minlength=n_labels)
+        per_axis['Coronal'] += np.bincount((coronal_index + plane).ravel(), minlength=shape[1] * n_labels).reshape(-1, n_labels)
+        per_axis['Axial'] += np.bincount((axial_index + plane).ravel(), minlength=shape[2] * n_labels).reshape(-1, n_labels)
+
+    stats = {}
+    counts = per_axis['Sagittal'].sum(axis=0)
+    for label in range(1, n_labels):
+        if counts[label] == 0:
+            continue
+        row = {'voxels': int(counts[label]), 'volume_mm3': float(counts[label] * voxel_mm3)}
+        for view, plane_counts in per_axis.items():
+            present = np.flatnonzero(plane_counts[:, label])
+            row[f"{view.lower()}_min"], row[f"{view.lower()}_max"] = int(present[0]), int(present[-1])
+            row[f"{view.lower()}_peak"] = int(np.argmax(plane_counts[:, label]))
+        stats[label] = row
+    return stats
+
+def _read_mask(path):
+    # Imported here, the ID page reads this module's tables without the imaging stack
+    import nibabel as nib
+    mask_img = nib.load(path)
+    return np.asanyarray(mask_img.dataobj), mask_img.header.get_zooms()[:3]
+
+def _stats_task(args):
+    subject_id, time_point, path = args
+    return subject_id, time_point, os.path.getmtime(path), compute_seg_stats(*_read_mask(path))
+
+def _store(conn, subject_id, time_point, source_mtime, stats):
+    conn.execute('DELETE FROM seg_stats WHERE id = ? AND time_point = ?', (subject_id, time_point))
+    rows = [[subject_id, time_point, label, source_mtime] + [row[column] for column in STAT_COLUMNS]
+            for label, row in stats.items()]
+    if not rows:
+        rows = [[subject_id, time_point, EMPTY_LABEL, source_mtime] + [None] * len(STAT_COLUMNS)]
+    conn.executemany(f"INSERT INTO seg_stats VALUES ({', '.join('?' * (len(STAT_COLUMNS) + 4))})", rows)
+
+def _stored_mtimes(conn):
+    return {(subject_id, time_point): source_mtime for subject_id, time_point, source_mtime in
+            conn.execute('SELECT DISTINCT id, time_point, source_mtime FROM seg_stats')}
+
+def get_seg_stats(data_path, subject_id, time_point):
+    # {label: stats}, computed here only if the batch run has not covered this mask yet
+    subject_id = int(subject_id)
+    path = lookup(data_path, subject_id, time_point, 'pred')
+    if path is None:
+        return {}
+    conn = connect_index(data_path)
+    try:
+        _create_table(conn)
+        rows = conn.execute(f"SELECT label, source_mtime, {', '.join(STAT_COLUMNS)} FROM seg_stats WHERE id = ? AND time_point = ?",
+                            (subject_id, time_point)).fetchall()
+        source_mtime = os.path.getmtime(path)
+        if rows and all(row[1] == source_mtime for row in rows):
+            return {label: dict(zip(STAT_COLUMNS, values)) for label, _, *values in rows if label != EMPTY_LABEL}
+        # The memory-mapped copy from the volume cache, read plane by plane, rather than a second gunzip
+        volume = open_volume(path, get_cache_dir(data_path, 'volumes'))
+        stats = compute_seg_stats(get_view_array(volume, 'Sagittal'), volume['spacing'])
+        _store(conn, subject_id, time_point, source_mtime, stats)
+        conn.commit()
+    finally:
+        conn.close()
+    return stats
+
+def cohort_volumes(data_path, time_point):
+    # Volumes in mL per ID, one column per label, read from the table without opening any mask
+    conn = connect_index(data_path)
+    try:
+        _create_table(conn)
+        df = pd.read_sql_query('SELECT id, label, volume_mm3 FROM seg_stats WHERE time_point = ? AND label != ?', conn, params=(time_point, EMPTY_LABEL))
+    finally:
+        conn.close()
+    volumes = df.pivot(index='id', columns='label', values='volume_mm3') / 1000.0
+    return volumes.rename(columns=lambda label: f"{LABEL_NAMES.get(label, f'Label {label}')} (mL)")
+
+def build_seg_stats(data_path, workers=None, ids=None):
+    conn = connect_index(data_path)
+    try:
+        _create_table(conn)
+        stored = _stored_mtimes(conn)
+        tasks = []
+        for subject_id in ids or list_ids(data_path):
+            for time_point in TIME_POINTS:
+                path = lookup(data_path, subject_id, time_point, 'pred')
+                if path is not None and stored.get((subject_id, time_point)) != os.path.getmtime(path):
+                    tasks.append((subject_id, time_point, path))
+
+        print(f"{len(tasks)} masks to process, {len(stored)} up to date")
+        # Workers only read masks, the rows are written here by a single connection
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_stats_task, task) for task in tasks]
+            for i, future in enumerate(as_completed(futures), 1):
+                subject_id, time_point, source_mtime, stats = future.result()
+                _store(conn, subject_id, time_point, source_mtime, stats)
+                conn.commit()
+                print(f"[{i}/{len(tasks)}] {subject_id} {time_point}: {len(stats)} labels")
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute per-label volumes and extents of every prediction mask")
+    parser.add_argument('data_path', help="Path to the data folder (e.g. /media/chuv/T7)")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--ids', type=int, nargs='*', help="Only process these IDs")
+    args = parser.parse_args()
+    build_seg_stats(args.data_path, args.workers, args.ids)
+
+if __name__ == '__main__':
+    main()
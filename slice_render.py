@@ -0,0 +1,56 @@
+import base64
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+IMAGE_MIME = {'png': 'image/png', 'webp': 'image/webp'}
+
+def colormap_lut(colors, alpha=None):
+    lut = np.round(np.asarray(colors, dtype=np.float64) * 255).astype(np.uint8)
+    if alpha is not None:
+        lut[:, 3] = round(alpha * 255)
+    return lut
+
+def window_to_uint8(slice, window_center, window_width):
+    min_val = window_center - window_width / 2
+    scale = 255.0 / max(window_width, 1e-6)
+    out = np.subtract(slice, min_val, dtype=np.float32)
+    out *= scale
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+def blend_mask(rgb, mask_slice, lut):
+    # Alpha-blend the LUT colour of each label into rgb, in place, only where the label is visible
+    colors = lut[np.clip(mask_slice, 0, len(lut) - 1).astype(np.intp)]
+    visible = colors[..., 3] > 0
+    if not visible.any():
+        return rgb
+    alpha = colors[visible, 3:4].astype(np.uint16)
+    blended = rgb[visible].astype(np.uint16) * (255 - alpha) + colors[visible, :3].astype(np.uint16) * alpha
+    rgb[visible] = ((blended + 127) // 255).astype(np.uint8)
+    return rgb
+
+def encode_image(image, image_format='png'):
+    buf = BytesIO()
+    if image_format == 'webp':
+        image.save(buf, format='WEBP', lossless=True, quality=0, method=0)
+    else:
+        image.save(buf, format='PNG', compress_level=1)
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+def render_rgb(slice, mask_slice=None, aspect_ratio=1, window_center=0.5, window_width=1.0, lut=None):
+    gray = window_to_uint8(slice, window_center, window_width)
+    rgb = np.repeat(gray[..., None], 3, axis=2)
+    if mask_slice is not None and lut is not None:
+        blend_mask(rgb, mask_slice, lut)
+
+    image = Image.fromarray(rgb, mode='RGB')
+    # Same convention as imshow(aspect=...): the aspect is pixel height over pixel width
+    height = max(1, int(round(image.height * aspect_ratio)))
+    if height != image.height:
+        image = image.resize((image.width, height), Image.BILINEAR)
+    return image
+
+def render_slice(slice, mask_slice=None, aspect_ratio=1, window_center=0.5, window_width=1.0, lut=None, image_format='png'):
+    image = render_rgb(slice, mask_slice, aspect_ratio, window_center, window_width, lut)
+    return encode_image(image, image_format)
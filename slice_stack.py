@@ -0,0 +1,169 @@
+import base64
+import json
+import math
+import os
+import threading
+from collections import defaultdict
+import numpy as np
+import streamlit.components.v1 as components
+from PIL import Image
+from volume_access import get_view_array, prune_volume_cache
+
+# One build per sheet at a time; concurrent sessions would otherwise write the same .tmp files
+_stack_locks = defaultdict(threading.Lock)
+
+def _tile_layout(n_slices):
+    cols = math.ceil(math.sqrt(n_slices))
+    return cols, math.ceil(n_slices / cols)
+
+def _encode_sheet(sheet, path):
+    # Lossless WebP keeps the sheet small and carries the mask alpha channel
+    image = Image.fromarray(sheet)
+    image.save(path + '.tmp', format='WEBP', lossless=True, quality=0, method=0)
+    os.replace(path + '.tmp', path)
+
+def _build_sheets(image_volume, mask_volume, view, lut, image_path, mask_path):
+    image_array = get_view_array(image_volume, view)
+    mask_array = get_view_array(mask_volume, view)
+    n_slices = image_array.shape[0]
+    # Tiles are stored already rotated the same way plot_slice displays them
+    tile_h, tile_w = image_array.shape[2], image_array.shape[1]
+    cols, rows = _tile_layout(n_slices)
+
+    p1, p99 = image_volume['p1'], image_volume['p99']
+    image_sheet = np.zeros((rows * tile_h, cols * tile_w), dtype=np.uint8)
+    mask_sheet = np.zeros((rows * tile_h, cols * tile_w, 4), dtype=np.uint8)
+    for i in range(n_slices):
+        row, col = divmod(i, cols)
+        tile = (slice(row * tile_h, (row + 1) * tile_h), slice(col * tile_w, (col + 1) * tile_w))
+        plane = np.rot90(np.asarray(image_array[i], dtype=np.float32))
+        image_sheet[tile] = np.clip((plane - p1) * (255.0 / (p99 - p1)), 0, 255).astype(np.uint8)
+        labels = np.rot90(np.asarray(mask_array[i]))
+        mask_sheet[tile] = lut[np.clip(labels, 0, len(lut) - 1).astype(np.intp)]
+
+    _encode_sheet(image_sheet, image_path)
+    _encode_sheet(mask_sheet, mask_path)
+    return {'n_slices': n_slices, 'cols': cols, 'tile_w': tile_w, 'tile_h': tile_h}
+
+def build_slice_stack(image_volume, mask_volume, view, lut):
+    # Encoded once per (volume, view) and kept next to the volume cache
+    prefix = os.path.join(image_volume['cache_dir'], f"{image_volume['key']}.{mask_volume['key']}.{view.lower()}")
+    meta_path, image_path, mask_path = prefix + '.json', prefix + '.image.webp', prefix + '.mask.webp'
+    with _stack_locks[prefix]:
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        else:
+            meta = _build_sheets(image_volume, mask_volume, view, lut, image_path, mask_path)
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.tmp', meta_path)
+            prune_volume_cache(image_volume['cache_dir'])
+
+    stack = dict(meta)
+    for name, path in (('image', image_path), ('mask', mask_path)):
+        with open(path, 'rb') as f:
+            stack[name] = base64.b64encode(f.read()).decode("utf-8")
+    return stack
+
+def slice_scrubber_html(stack, aspect_ratio=1, slice_num=None, window_center=0.5, window_width=1.0, show_mask=True, display_width=512):
+    display_height = int(round(display_width * stack['tile_h'] * aspect_ratio / stack['tile_w']))
+    config = {
+        'n': stack['n_slices'], 'cols': stack['cols'], 'tileW': stack['tile_w'], 'tileH': stack['tile_h'],
+        'slice': stack['n_slices'] // 2 if slice_num is None else slice_num,
+        'center': window_center, 'width': window_width, 'showMask': show_mask,
+    }
+    return f"""
+    <div style="background: black; color: white; font-family: sans-serif; font-size: 13px; text-align: center;">
+        <canvas id="view" width="{display_width}" height="{display_height}" style="max-width: 100%;"></canvas>
+        <div style="display: flex; gap: 12px; justify-content: center; align-items: center; padding: 6px;">
+            <label>Slice <span id="slice-label"></span> <input id="slice" type="range" min="0" max="{config['n'] - 1}"></label>
+            <label>Center <input id="center" type="range" min="0" max="1" step="0.01"></label>
+            <label>Width <input id="width" type="range" min="0" max="1" step="0.01"></label>
+            <label><input id="mask" type="checkbox"> Mask</label>
+        </div>
+    </div>
+    <script>
+        const cfg = {json.dumps(config)};
+        const canvas = document.getElementById('view');
+        const ctx = canvas.getContext('2d');
+        const tile = document.createElement('canvas');
+        tile.width = cfg.tileW;
+        tile.height = cfg.tileH;
+        const tileCtx = tile.getContext('2d', {{willReadFrequently: true}});
+        const controls = {{
+            slice: document.getElementById('slice'),
+            center: document.getElementById('center'),
+            width: document.getElementById('width'),
+            mask: document.getElementById('mask'),
+        }};
+        controls.slice.value = cfg.slice;
+        controls.center.value = cfg.center;
+        controls.width.value = cfg.width;
+        controls.mask.checked = cfg.showMask;
+
+        const image = new Image();
+        const mask = new Image();
+        let pending = 2;
+        const lut = new Uint8ClampedArray(256);
+
+        function updateLut() {{
+            const center = parseFloat(controls.center.value);
+            const width = Math.max(parseFloat(controls.width.value), 1e-6);
+            for (let v = 0; v < 256; v++) {{
+                lut[v] = Math.min(Math.max((v / 255 - (center - width / 2)) / width, 0), 1) * 255;
+            }}
+        }}
+
+        function draw() {{
+            if (pending > 0) return;
+            const i = parseInt(controls.slice.value);
+            const sx = (i % cfg.cols) * cfg.tileW;
+            const sy = Math.floor(i / cfg.cols) * cfg.tileH;
+            document.getElementById('slice-label').textContent = i;
+
+            tileCtx.drawImage(image, sx, sy, cfg.tileW, cfg.tileH, 0, 0, cfg.tileW, cfg.tileH);
+            const pixels = tileCtx.getImageData(0, 0, cfg.tileW, cfg.tileH);
+            const data = pixels.data;
+            for (let p = 0; p < data.length; p += 4) {{
+                const v = lut[data[p]];
+                data[p] = v;
+                data[p + 1] = v;
+                data[p + 2] = v;
+            }}
+            tileCtx.putImageData(pixels, 0, 0);
+
+            ctx.imageSmoothingEnabled = true;
+            ctx.drawImage(tile, 0, 0, canvas.width, canvas.height);
+            if (controls.mask.checked) {{
+                ctx.imageSmoothingEnabled = false;
+                ctx.drawImage(mask, sx, sy, cfg.tileW, cfg.tileH, 0, 0, canvas.width, canvas.height);
+            }}
+        }}
+
+        function step(delta) {{
+            controls.slice.value = Math.min(Math.max(parseInt(controls.slice.value) + delta, 0), cfg.n - 1);
+            draw();
+        }}
+
+        image.onload = mask.onload = () => {{ pending -= 1; draw(); }};
+        image.src = 'data:image/webp;base64,{stack['image']}';
+        mask.src = 'data:image/webp;base64,{stack['mask']}';
+
+        controls.slice.addEventListener('input', draw);
+        controls.mask.addEventListener('change', draw);
+        controls.center.addEventListener('input', () => {{ updateLut(); draw(); }});
+        controls.width.addEventListener('input', () => {{ updateLut(); draw(); }});
+        canvas.addEventListener('wheel', (event) => {{ event.preventDefault(); step(Math.sign(event.deltaY)); }});
+        document.addEventListener('keydown', (event) => {{
+            if (event.key === 'ArrowUp' || event.key === 'ArrowRight') step(1);
+            if (event.key === 'ArrowDown' || event.key === 'ArrowLeft') step(-1);
+        }});
+        updateLut();
+    </script>
+    """
+
+def show_slice_scrubber(stack, aspect_ratio=1, slice_num=None, window_center=0.5, window_width=1.0, show_mask=True, display_width=512):
+    html = slice_scrubber_html(stack, aspect_ratio, slice_num, window_center, window_width, show_mask, display_width)
+    display_height = int(round(display_width * stack['tile_h'] * aspect_ratio / stack['tile_w']))
+    components.html(html, height=display_height + 60)
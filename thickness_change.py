@@ -0,0 +1,108 @@
+import os
+import numpy as np
+from cohort_index import TIME_POINTS, get_cache_dir
+from mesh_store import get_reference_mesh
+from thickness_store import load_thickness, open_thickness_store
+
+# Visit times in years since baseline, in TIME_POINTS order
+VISIT_YEARS = np.array([0, 1, 2, 4, 6], dtype=np.float64)
+
+# One-sided 95% Student t critical values by degrees of freedom (n visits - 2)
+T_CRITICAL = {1: 6.314, 2: 2.920, 3: 2.353}
+MIN_LOSS_SLOPE = 0.05  # mm/year
+
+CHANGE_SCALARS = {
+    'Thickness': 'thickness',
+    'Change vs baseline (mm)': 'delta',
+    'Annualised slope (mm/year)': 'slope',
+    'Significant loss': 'loss',
+}
+
+def load_subject_visits(data_path, subject_id, bone):
+    n_vertices = get_reference_mesh(os.path.join(data_path, 'DATA', bone + '_ref_final.stl')).n_points
+    visits = np.full((len(TIME_POINTS), n_vertices), np.nan, dtype=np.float32)
+    for i, time_point in enumerate(TIME_POINTS):
+        try:
+            visits[i] = load_thickness(data_path, subject_id, time_point, bone)
+        except FileNotFoundError:
+            continue
+    return visits
+
+def compute_change_maps(visits, years=VISIT_YEARS, min_loss_slope=MIN_LOSS_SLOPE):
+    # visits is (..., time points, vertices); every statistic is computed in one pass over all vertices
+    visits = np.asarray(visits, dtype=np.float64)
+    valid = ~np.isnan(visits)
+    t = np.broadcast_to(years[:, None], visits.shape)
+    y = np.where(valid, visits, 0.0)
+    tv = np.where(valid, t, 0.0)
+
+    n = valid.sum(axis=-2)
+    sum_t, sum_y = tv.sum(axis=-2), y.sum(axis=-2)
+    sxx = (tv * tv).sum(axis=-2) - np.divide(sum_t ** 2, n, out=np.zeros_like(sum_t), where=n > 0)
+    sxy = (tv * y).sum(axis=-2) - np.divide(sum_t * sum_y, n, out=np.zeros_like(sum_t), where=n > 0)
+
+    fit = (n >= 2) & (sxx > 0)
+    slope = np.divide(sxy, sxx, out=np.full_like(sxx, np.nan), where=fit)
+    intercept = np.divide(sum_y - slope * sum_t, n, out=np.full_like(sxx, np.nan), where=fit)
+
+    # Residual standard error of the slope for the one-sided loss test
+    residuals = np.where(valid, visits - (intercept[..., None, :] + slope[..., None, :] * t), 0.0)
+    dof = n - 2
+    mse = np.divide((residuals ** 2).sum(axis=-2), dof, out=np.full_like(sxx, np.nan), where=fit & (dof > 0))
+    se = np.sqrt(np.divide(mse, sxx, out=np.full_like(sxx, np.nan), where=fit))
+    t_critical = np.zeros_like(sxx)
+    for df, value in T_CRITICAL.items():
+        t_critical[dof == df] = value
+    t_stat = np.divide(slope, se, out=np.full_like(sxx, -np.inf), where=se > 0)
+    loss = fit & (dof > 0) & (slope <= -min_loss_slope) & (t_stat <= -t_critical)
+
+    delta = visits - visits[..., :1, :]
+    return {
+        'delta': delta.astype(np.float32),
+        'slope': slope.astype(np.float32),
+        'loss': np.where(fit & (dof > 0), loss, np.nan).astype(np.float32),
+        'n_visits': n.astype(np.uint8),
+    }
+
+def add_change_arrays(mesh, maps, time_point_index):
+    mesh.point_data['delta'] = maps['delta'][time_point_index]
+    mesh.point_data['slope'] = maps['slope']
+    mesh.point_data['loss'] = maps['loss']
+    return mesh
+
+def change_clim(maps, scalar):
+    if scalar == 'loss':
+        return (0, 1)
+    limit = np.nanmax(np.abs(maps[scalar])) if np.any(~np.isnan(maps[scalar])) else 1.0
+    return (-limit, limit)
+
+def compute_cohort_change(data_path, bone, chunk_size=32):
+    # Streams the thickness store in subject chunks and writes the results as memory-mapped arrays
+    store, entries = open_thickness_store(data_path, bone)
+    if store is None:
+        raise FileNotFoundError(f"No thickness store for {bone}, run thickness_store.py first")
+    out_dir = get_cache_dir(data_path, 'change')
+    n_subjects, n_time_points, n_vertices = store.shape
+    outputs = {
+        'delta': np.lib.format.open_memmap(os.path.join(out_dir, f"{bone}_delta.npy"), mode='w+', dtype=np.float32,
+                                           shape=(n_subjects, n_time_points, n_vertices)),
+        'slope': np.lib.format.open_memmap(os.path.join(out_dir, f"{bone}_slope.npy"), mode='w+', dtype=np.float32,
+                                           shape=(n_subjects, n_vertices)),
+        'loss': np.lib.format.open_memmap(os.path.join(out_dir, f"{bone}_loss.npy"), mode='w+', dtype=np.float32,
+                                          shape=(n_subjects, n_vertices)),
+    }
+    for start in range(0, n_subjects, chunk_size):
+        maps = compute_change_maps(np.asarray(store[start:start + chunk_size]))
+        for name, output in outputs.items():
+            output[start:start + chunk_size] = maps[name]
+    for output in outputs.values():
+        output.flush()
+
+    row_ids = {row: subject_id for (subject_id, _), (row, _, _) in entries.items()}
+    np.save(os.path.join(out_dir, f"{bone}_ids.npy"), np.array([row_ids.get(row, -1) for row in range(n_subjects)]))
+
+if __name__ == '__main__':
+    import sys
+    from cohort_index import BONES
+    for bone in BONES:
+        compute_cohort_change(sys.argv[1], bone)
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+from cohort_index import TIME_POINTS, BONES, connect_index, lookup
+from thickness_store import load_thickness
+
+PERCENTILES = (1, 5, 50, 95, 99)
+STAT_COLUMNS = ['n_values', 'nan_count', 'min', 'max'] + [f"p{p}" for p in PERCENTILES]
+
+# Colour limit options, as (lower, upper) statistic names
+CLIM_MODES = {
+    'Min / Max': ('min', 'max'),
+    'Robust (1st - 99th percentile)': ('p1', 'p99'),
+    'Robust (5th - 95th percentile)': ('p5', 'p95'),
+}
+
+def _create_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS thickness_stats (
+            id INTEGER NOT NULL,
+            time_point TEXT NOT NULL,
+            bone TEXT NOT NULL,
+            source_mtime REAL NOT NULL,
+            {', '.join(f'{column} REAL' for column in STAT_COLUMNS)},
+            PRIMARY KEY (id, time_point, bone)
+        )
+    """)
+
+def compute_thickness_stats(thickness):
+    thickness = np.asarray(thickness, dtype=np.float64)
+    valid = thickness[~np.isnan(thickness)]
+    stats = {'n_values': len(thickness), 'nan_count': len(thickness) - len(valid)}
+    if len(valid):
+        stats['min'], stats['max'] = valid.min(), valid.max()
+        for p, value in zip(PERCENTILES, np.percentile(valid, PERCENTILES)):
+            stats[f"p{p}"] = value
+    else:
+        stats.update({column: np.nan for column in STAT_COLUMNS[2:]})
+    return {column: float(stats[column]) for column in STAT_COLUMNS}
+
+def get_thickness_stats(data_path, subject_id):
+    subject_id = int(subject_id)
+    conn = connect_index(data_path)
+    try:
+        _create_table(conn)
+        cached = {(time_point, bone): (source_mtime, dict(zip(STAT_COLUMNS, (np.nan if value is None else value for value in values))))
+                  for time_point, bone, source_mtime, *values in conn.execute(
+                      f"SELECT time_point, bone, source_mtime, {', '.join(STAT_COLUMNS)} FROM thickness_stats WHERE id = ?",
+                      (subject_id,))}
+
+        stats = {}
+        for time_point in TIME_POINTS:
+            for bone in BONES:
+                thickness_path = lookup(data_path, subject_id, time_point, f"{bone}_thickness")
+                if thickness_path is None:
+                    continue
+                source_mtime = os.path.getmtime(thickness_path)
+                entry = cached.get((time_point, bone))
+                if entry is not None and entry[0] == source_mtime:
+                    stats[(time_point, bone)] = entry[1]
+                    continue
+
+                # Missing or stale: the source file changed since the stats were computed
+                values = compute_thickness_stats(load_thickness(data_path, subject_id, time_point, bone))
+                conn.execute(f"INSERT OR REPLACE INTO thickness_stats VALUES ({', '.join('?' * (len(STAT_COLUMNS) + 4))})",
+                             [subject_id, time_point, bone, source_mtime] + [values[column] for column in STAT_COLUMNS])
+                stats[(time_point, bone)] = values
+        conn.commit()
+    finally:
+        conn.close()
+    return stats
+
+def get_clim(data_path, subject_id, bone, mode='Min / Max'):
+    lower, upper = CLIM_MODES[mode]
+    stats = [values for (_, stat_bone), values in get_thickness_stats(data_path, subject_id).items()
+             if stat_bone == bone and not np.isnan(values[lower])]
+    if not stats:
+        return None
+    return (min(values[lower] for values in stats), max(values[upper] for values in stats))
+
+if __name__ == '__main__':
+    import sys
+    from cohort_index import list_ids
+    for subject_id in list_ids(sys.argv[1]):
+        get_thickness_stats(sys.argv[1], subject_id)
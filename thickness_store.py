@@ -0,0 +1,122 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from cohort_index import TIME_POINTS, BONES, connect_index, get_cache_dir, list_ids, lookup
+from memory_cache import load_file
+from mesh_store import get_reference_mesh
+
+_lock = threading.Lock()
+_stores = {}
+
+def _parse_thickness_file(thickness_path):
+    thickness_data = pd.read_csv(thickness_path, header=None, names=['thickness'], dtype=np.float32)
+    thickness = thickness_data['thickness'].values
+    # Cached arrays are shared between sessions
+    thickness.flags.writeable = False
+    return thickness
+
+def read_thickness_file(thickness_path):
+    return load_file('thickness', thickness_path, _parse_thickness_file)
+
+def store_path(data_path, bone):
+    return os.path.join(get_cache_dir(data_path, 'thickness'), f"{bone}.npy")
+
+def _create_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS thickness_store (
+            id INTEGER NOT NULL,
+            time_point TEXT NOT NULL,
+            bone TEXT NOT NULL,
+            row INTEGER NOT NULL,
+            source_path TEXT NOT NULL,
+            source_mtime REAL NOT NULL,
+            PRIMARY KEY (id, time_point, bone)
+        )
+    """)
+
+def build_thickness_store(data_path, bones=BONES):
+    subject_ids = list_ids(data_path)
+    conn = connect_index(data_path)
+    try:
+        _create_table(conn)
+        for bone in bones:
+            n_vertices = get_reference_mesh(os.path.join(data_path, 'DATA', bone + '_ref_final.stl')).n_points
+            path = store_path(data_path, bone)
+            tmp_path = path + '.tmp.npy'
+            store = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                              shape=(len(subject_ids), len(TIME_POINTS), n_vertices))
+            rows = []
+            for row, subject_id in enumerate(subject_ids):
+                store[row] = np.nan
+                for tp_index, time_point in enumerate(TIME_POINTS):
+                    thickness_path = lookup(data_path, subject_id, time_point, f"{bone}_thickness")
+                    if thickness_path is None:
+                        continue
+                    thickness = _parse_thickness_file(thickness_path)
+                    if len(thickness) != n_vertices:
+                        print(f"Skipping {thickness_path}: {len(thickness)} values for {n_vertices} vertices")
+                        continue
+                    store[row, tp_index] = thickness
+                    rows.append((subject_id, time_point, bone, row, thickness_path, os.path.getmtime(thickness_path)))
+            store.flush()
+            del store
+
+            conn.execute('DELETE FROM thickness_store WHERE bone = ?', (bone,))
+            conn.executemany('INSERT INTO thickness_store VALUES (?, ?, ?, ?, ?, ?)', rows)
+            conn.commit()
+            # Replacing the file last bumps its mtime, which makes readers reload the row table
+            os.replace(tmp_path, path)
+    finally:
+        conn.close()
+    with _lock:
+        _stores.clear()
+
+def open_thickness_store(data_path, bone):
+    path = store_path(data_path, bone)
+    try:
+        mtime = os.path.getmtime(path)
+    except FileNotFoundError:
+        return None, {}
+    with _lock:
+        cached = _stores.get(path)
+        if cached is None or cached[0] != mtime:
+            conn = connect_index(data_path)
+            try:
+                _create_table(conn)
+                entries = {(subject_id, time_point): (row, source_path, source_mtime)
+                           for subject_id, time_point, row, source_path, source_mtime in conn.execute(
+                               'SELECT id, time_point, row, source_path, source_mtime FROM thickness_store WHERE bone = ?',
+                               (bone,))}
+            finally:
+                conn.close()
+            cached = (mtime, np.load(path, mmap_mode='r'), entries)
+            _stores[path] = cached
+    return cached[1], cached[2]
+
+def read_stored_thickness(data_path, subject_id, time_point, bone):
+    store, entries = open_thickness_store(data_path, bone)
+    entry = entries.get((int(subject_id), time_point))
+    if entry is None:
+        return None
+    row, source_path, source_mtime = entry
+    try:
+        if os.path.getmtime(source_path) != source_mtime:
+            return None
+    except FileNotFoundError:
+        return None
+    # Zero-copy view into the memory-mapped store
+    return store[row, TIME_POINTS.index(time_point)]
+
+def load_thickness(data_path, subject_id, time_point, bone):
+    thickness = read_stored_thickness(data_path, subject_id, time_point, bone)
+    if thickness is None:
+        thickness_path = lookup(data_path, subject_id, time_point, f"{bone}_thickness")
+        if thickness_path is None:
+            raise FileNotFoundError(f"No {bone} thickness for ID {subject_id} at time point {time_point}")
+        thickness = read_thickness_file(thickness_path)
+    return thickness
+
+if __name__ == '__main__':
+    import sys
+    build_thickness_store(sys.argv[1])
@@ -0,0 +1,91 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from memory_cache import cache_stats
+
+# Every finished rerun is appended here when set
+TRACE_FILE = os.environ.get('OAI_TRACE_FILE')
+SPAN_FIELDS = ['calls', 'wall_s', 'bytes_read', 'cache_hits', 'cache_misses', 'rss_delta']
+
+# Streamlit runs each session's script in its own thread, so spans are collected per thread
+_local = threading.local()
+_file_lock = threading.Lock()
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def _bytes_read():
+    # Bytes this thread read through read() syscalls, page cache included (Linux only)
+    try:
+        with open('/proc/thread-self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def _rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return 0
+
+def _snapshot():
+    stats = cache_stats()
+    return time.perf_counter(), _bytes_read(), stats['hits'], stats['misses'], _rss()
+
+def start_rerun(page=None):
+    _local.rerun = {'page': page, 'started': time.time(), 'spans': {}}
+    _local.depth = 0
+
+def current_rerun():
+    return getattr(_local, 'rerun', None)
+
+@contextmanager
+def trace(name):
+    # Cache and memory counters are process-wide, so concurrent sessions and prefetch threads show up in them
+    rerun = current_rerun()
+    if rerun is None:
+        yield
+        return
+    # Registered on entry so that spans are listed in call order, outer before inner
+    span = rerun['spans'].setdefault(name, dict(dict.fromkeys(SPAN_FIELDS, 0), depth=_local.depth))
+    before = _snapshot()
+    _local.depth += 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        after = _snapshot()
+        span['calls'] += 1
+        for field, start, end in zip(SPAN_FIELDS[1:], before, after):
+            span[field] += end - start
+
+def traced(name=None):
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with trace(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def finish_rerun():
+    # Closes the current rerun and returns it as a JSON-ready record
+    rerun = current_rerun()
+    if rerun is None:
+        return None
+    _local.rerun = None
+    record = dict(rerun, wall_s=time.time() - rerun['started'])
+    if TRACE_FILE:
+        with _file_lock, open(TRACE_FILE, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    return record
+
+def records_to_jsonl(records):
+    return ''.join(json.dumps(record) + '\n' for record in records)
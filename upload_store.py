@@ -0,0 +1,58 @@
+import gzip
+import os
+import shutil
+import time
+import numpy as np
+import nibabel as nib
+
+CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_DIR = os.environ.get('OAI_UPLOAD_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'oai_explorer', 'uploads'))
+UPLOAD_MAX_AGE = 24 * 3600  # seconds
+SAMPLE_VOXELS = 2_000_000
+
+def prune_uploads(directory=UPLOAD_DIR, max_age=UPLOAD_MAX_AGE):
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
+def save_upload(uploaded_file, directory=UPLOAD_DIR):
+    # Copied to disk in chunks once per upload, without an extra bytes copy of the file
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{uploaded_file.file_id}_{os.path.basename(uploaded_file.name)}")
+    if not os.path.exists(path):
+        prune_uploads(directory)
+        uploaded_file.seek(0)
+        with open(path + '.part', 'wb') as f:
+            shutil.copyfileobj(uploaded_file, f, CHUNK_SIZE)
+        os.replace(path + '.part', path)
+    return path
+
+def decompress_nifti(path):
+    # .nii.gz cannot be memory-mapped, so it is inflated to a .nii next to it once
+    if not path.endswith('.gz'):
+        return path
+    nii_path = path[:-3]
+    if not os.path.exists(nii_path):
+        with gzip.open(path, 'rb') as src, open(nii_path + '.part', 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        os.replace(nii_path + '.part', nii_path)
+    return nii_path
+
+def open_nifti(path):
+    # The array proxy reads through a memory map, so only the planes that are sliced get loaded
+    nifti_img = nib.load(decompress_nifti(path), mmap=True)
+    return nifti_img.dataobj, tuple(float(s) for s in nifti_img.header.get_zooms()[:3])
+
+def read_plane(volume, axis, index):
+    # First volume of 4D data
+    key = [slice(None)] * 3 + [0] * (len(volume.shape) - 3)
+    key[axis] = index
+    return np.asarray(volume[tuple(key)])
+
+def estimate_percentiles(volume, percentiles=(1, 99), max_voxels=SAMPLE_VOXELS):
+    # Percentiles of every step-th axial plane, read one plane at a time
+    n_planes = volume.shape[2]
+    step = max(1, int(np.ceil(n_planes * volume.shape[0] * volume.shape[1] / max_voxels)))
+    sample = np.concatenate([read_plane(volume, 2, k).ravel() for k in range(0, n_planes, step)])
+    return tuple(float(p) for p in np.percentile(sample, percentiles))
@@ -0,0 +1,41 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from cohort_index import get_cache_dir, lookup
+from volume_access import VIEW_AXES, normalize_slice, open_volume, plane_spacing, read_plane
+from volume_stats import get_volume_stats
+
+# One worker per visit, so a cold subject decompresses its five scans at the same time
+MAX_WORKERS = int(os.environ.get('OAI_VISIT_WORKERS', 5))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='oai-visit')
+
+def _open_visit(data_path, subject_id, time_point):
+    image_path = lookup(data_path, subject_id, time_point, 'dess')
+    mask_path = lookup(data_path, subject_id, time_point, 'pred')
+    if image_path is None or mask_path is None:
+        return None
+    volumes_dir = get_cache_dir(data_path, 'volumes')
+    image_volume = open_volume(image_path, volumes_dir)
+    image_volume.update(get_volume_stats(data_path, image_volume))
+    return {'image': image_volume, 'mask': open_volume(mask_path, volumes_dir)}
+
+def open_visits(data_path, subject_id, time_points):
+    # Visits without a scan or a prediction map to None
+    futures = {time_point: _executor.submit(_open_visit, data_path, subject_id, time_point) for time_point in time_points}
+    return {time_point: future.result() for time_point, future in futures.items()}
+
+def visit_slice_count(visits, view):
+    return max((visit['image']['shape'][VIEW_AXES[view]] for visit in visits.values() if visit), default=1)
+
+def _read_visit_plane(visit, view, index):
+    image_volume = visit['image']
+    # Visits can differ in extent, the shared index is clamped to each volume
+    index = min(index, image_volume['shape'][VIEW_AXES[view]] - 1)
+    slice_data = normalize_slice(read_plane(image_volume, view, index), image_volume['p1'], image_volume['p99'])
+    return slice_data, read_plane(visit['mask'], view, index), plane_spacing(image_volume['spacing'], view), index
+
+def read_visit_planes(visits, view, index):
+    # Only the shown plane of each memory-mapped volume is read
+    futures = {time_point: _executor.submit(_read_visit_plane, visit, view, index)
+               for time_point, visit in visits.items() if visit}
+    return {time_point: futures[time_point].result() if time_point in futures else None for time_point in visits}
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+import numpy as np
+from memory_cache import load_file
+
+VIEW_AXES = {'Sagittal': 0, 'Coronal': 1, 'Axial': 2}
+
+# The 'volumes' cache directory (cohort_index.get_cache_dir) holds the decompressed copies, <key>.json and
+# <key>.axisN.npy, and the slice stack sheets built from them, <image key>.<mask key>.<view>.*; beyond this many
+# bytes the least recently opened volumes are removed together with their sheets
+VOLUME_CACHE_BYTES = int(os.environ.get('OAI_VOLUME_CACHE_BYTES', 64 * 1024 ** 3))
+# Volumes opened more recently than this are kept regardless, another session may still be reading them
+MIN_CACHE_AGE = 600
+
+_key_locks = defaultdict(threading.Lock)
+_prune_lock = threading.Lock()
+
+def _cache_key(filepath):
+    stat = os.stat(filepath)
+    return hashlib.sha1(f"{os.path.abspath(filepath)}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+
+def _view_path(volume, axis):
+    return os.path.join(volume['cache_dir'], f"{volume['key']}.axis{axis}.npy")
+
+def _save_atomic(path, array):
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+def _cache_groups(cache_dir):
+    # {volume key: [bytes, last use, paths]}, every file name starts with the key of the volume it was built from
+    groups = {}
+    for entry in os.scandir(cache_dir):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        group = groups.setdefault(entry.name.split('.')[0], [0, 0.0, []])
+        group[0] += stat.st_size
+        group[1] = max(group[1], stat.st_mtime)
+        group[2].append(entry.path)
+    return groups
+
+def volume_cache_bytes(cache_dir):
+    return sum(size for size, _, _ in _cache_groups(cache_dir).values())
+
+def prune_volume_cache(cache_dir, max_bytes=VOLUME_CACHE_BYTES):
+    # One pruning pass at a time per process; volumes being opened or converted right now are skipped
+    if not _prune_lock.acquire(blocking=False):
+        return
+    try:
+        groups = _cache_groups(cache_dir)
+        total = sum(size for size, _, _ in groups.values())
+        now = time.time()
+        for key, (size, last_used, paths) in sorted(groups.items(), key=lambda item: item[1][1]):
+            if total <= max_bytes or now - last_used < MIN_CACHE_AGE:
+                break
+            lock = _key_locks[key]
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            finally:
+                lock.release()
+            total -= size
+    finally:
+        _prune_lock.release()
+
+def is_volume_cached(filepath, cache_dir):
+    return os.path.exists(os.path.join(cache_dir, f"{_cache_key(filepath)}.json"))
+
+def open_volume(filepath, cache_dir):
+    key = _cache_key(filepath)
+    meta_path = os.path.join(cache_dir, f"{key}.json")
+    created = False
+    with _key_locks[key]:
+        if not os.path.exists(meta_path):
+            # Decompress the .nii.gz once; later opens only memory-map the uncompressed copy
+            import nibabel as nib
+            nifti_img = nib.load(filepath)
+            image_np = np.asanyarray(nifti_img.dataobj)
+            meta = {
+                'key': key,
+                'source': os.path.abspath(filepath),
+                'shape': list(image_np.shape[:3]),
+                'spacing': [float(s) for s in nifti_img.header.get_zooms()[:3]],
+            }
+            _save_atomic(os.path.join(cache_dir, f"{key}.axis0.npy"), image_np)
+            del image_np
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.tmp', meta_path)
+            created = True
+        else:
+            # The metadata mtime is the volume's last use for the cache pruning
+            os.utime(meta_path)
+        with open(meta_path) as f:
+            volume = json.load(f)
+    volume['cache_dir'] = cache_dir
+    if created:
+        prune_volume_cache(cache_dir)
+    return volume
+
+def get_view_array(volume, view):
+    # Each view gets its own C-ordered copy so that a plane is one contiguous read
+    axis = VIEW_AXES[view]
+    path = _view_path(volume, axis)
+    created = False
+    with _key_locks[volume['key']]:
+        if not os.path.exists(path):
+            base = np.load(_view_path(volume, 0), mmap_mode='r')
+            _save_atomic(path, np.ascontiguousarray(np.moveaxis(base, axis, 0)))
+            created = True
+    if created:
+        prune_volume_cache(volume['cache_dir'])
+    return load_file('volume', path, lambda p: np.load(p, mmap_mode='r'))
+
+def read_plane(volume, view, index):
+    return np.array(get_view_array(volume, view)[index])
+
+def plane_spacing(spacing, view):
+    if view == "Axial":
+        return (spacing[0], spacing[1])
+    elif view == "Coronal":
+        return (spacing[0], spacing[2])
+    else:  # Sagittal
+        return (spacing[1], spacing[2])
+
+def normalize_slice(slice, p1, p99):
+    # Affine map of one plane to 0-1 float32, p1/p99 come from the per-volume statistics
+    scale = np.float32(1.0 / max(p99 - p1, 1e-6))
+    return np.clip((slice.astype(np.float32) - np.float32(p1)) * scale, 0, 1)
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+from cohort_index import connect_index
+
+N_BINS = 4096
+STAT_COLUMNS = ['p1', 'p99', 'window_center', 'window_width']
+# Suggested window: this percentile range of the voxels above p1, on the normalised 0-1 scale
+WINDOW_PERCENTILES = (5, 99.5)
+
+def _create_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS volume_stats (
+            path TEXT PRIMARY KEY,
+            source_mtime REAL NOT NULL,
+            {', '.join(f'{column} REAL' for column in STAT_COLUMNS)}
+        )
+    """)
+
+def volume_histogram(array):
+    # One pass over the planes of a memory-mapped volume; 8/16-bit integers get one bin per value
+    if np.issubdtype(array.dtype, np.integer) and array.dtype.itemsize <= 2:
+        info = np.iinfo(array.dtype)
+        counts = np.zeros(int(info.max) - int(info.min) + 1, dtype=np.int64)
+        for plane in array:
+            counts += np.bincount(np.asarray(plane, dtype=np.int64).ravel() - int(info.min), minlength=len(counts))
+        return counts, np.arange(int(info.min), int(info.max) + 2, dtype=np.float64)
+
+    lo = min(float(np.nanmin(plane)) for plane in array)
+    hi = max(float(np.nanmax(plane)) for plane in array)
+    hi = hi if hi > lo else lo + 1.0
+    counts = np.zeros(N_BINS, dtype=np.int64)
+    for plane in array:
+        counts += np.histogram(np.asarray(plane), bins=N_BINS, range=(lo, hi))[0]
+    return counts, np.linspace(lo, hi, N_BINS + 1)
+
+def histogram_percentiles(counts, edges, percentiles):
+    # Linear interpolation inside the bin that holds each target rank
+    cumulative = np.cumsum(counts)
+    targets = np.asarray(percentiles, dtype=np.float64) / 100 * cumulative[-1]
+    index = np.minimum(np.searchsorted(cumulative, targets, side='left'), len(counts) - 1)
+    below = np.where(index > 0, cumulative[index - 1], 0)
+    fraction = np.clip((targets - below) / np.maximum(counts[index], 1), 0, 1)
+    return edges[index] + fraction * (edges[index + 1] - edges[index])
+
+def auto_window(counts, edges, p1, p99):
+    foreground = np.where(edges[1:] > p1, counts, 0)
+    if foreground.sum() == 0 or p99 <= p1:
+        return 0.5, 1.0
+    low, high = np.clip((histogram_percentiles(foreground, edges, WINDOW_PERCENTILES) - p1) / (p99 - p1), 0, 1)
+    return round(float(low + high) / 2, 2), round(max(float(high - low), 0.01), 2)
+
+def compute_volume_stats(array):
+    counts, edges = volume_histogram(array)
+    p1, p99 = (float(p) for p in histogram_percentiles(counts, edges, (1, 99)))
+    window_center, window_width = auto_window(counts, edges, p1, p99)
+    return {'p1': p1, 'p99': p99, 'window_center': window_center, 'window_width': window_width}
+
+def get_volume_stats(data_path, volume):
+    # volume is an open_volume entry; stats are keyed by its source file and recomputed when it changes
+    source_mtime = os.path.getmtime(volume['source'])
+    conn = connect_index(data_path)
+    try:
+        _create_table(conn)
+        row = conn.execute(f"SELECT source_mtime, {', '.join(STAT_COLUMNS)} FROM volume_stats WHERE path = ?",
+                           (volume['source'],)).fetchone()
+        if row is not None and row[0] == source_mtime:
+            return dict(zip(STAT_COLUMNS, row[1:]))
+
+        array = np.load(os.path.join(volume['cache_dir'], f"{volume['key']}.axis0.npy"), mmap_mode='r')
+        stats = compute_volume_stats(array)
+        conn.execute(f"INSERT OR REPLACE INTO volume_stats VALUES ({', '.join('?' * (len(STAT_COLUMNS) + 2))})",
+                     [volume['source'], source_mtime] + [stats[column] for column in STAT_COLUMNS])
+        conn.commit()
+    finally:
+        conn.close()
+    return stats
+
+if __name__ == '__main__':
+    import sys
+    from cohort_index import TIME_POINTS, get_cache_dir, list_ids, lookup
+    from volume_access import open_volume
+    data_path = sys.argv[1]
+    volumes_dir = get_cache_dir(data_path, 'volumes')
+    for subject_id in list_ids(data_path):
+        for time_point in TIME_POINTS:
+            path = lookup(data_path, subject_id, time_point, 'dess')
+            if path is not None:
+                get_volume_stats(data_path, open_volume(path, volumes_dir))